@@ -1,21 +1,33 @@
 #!/usr/bin/env python3
 import os
 import sys
-import json
 import pickle
 import subprocess
 import shutil
+import hashlib
+import math
+import time
+import bisect
+import base64
+import codecs
+import secrets
+import threading
+import httpx
+import orjson
 import numpy as np
+from scipy.spatial import cKDTree
 
 from flask import (
     Flask,
     request,
-    render_template_string,
+    stream_template,
     send_from_directory,
-    jsonify,
-    session
+    Response,
+    g,
 )
-from datetime import timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # ─── “Where is our piecewise‐affine mapper?” ─────────────────────────────────
 # We assume:
@@ -44,18 +56,44 @@ if not os.path.exists(MAPPER_PKL):
         f"mapper.pkl not found at {MAPPER_PKL!r}. Please generate it first."
     )
 mapper = PiecewiseAffineMapper.load(MAPPER_PKL)
+# One lookup now so the (optional) numba JIT compiles at startup, not on the
+# first /get_location
+mapper.gps_to_pixel(*mapper.gps_pts[0])
+
+# KD-tree over the calibration anchors (lat/lon space) for the out-of-hull
+# fallback in gps_to_pixel(), plus the matching pixel anchors.
+GPS_TREE  = cKDTree(np.ascontiguousarray(mapper.gps_pts, dtype=np.float64))
+PIXEL_PTS = np.ascontiguousarray(mapper.pixel_pts)
+PIXEL_PTS_LIST = PIXEL_PTS.tolist()
 # ───────────────────────────────────────────────────────────────────────────────
 
 
 app = Flask(__name__)
-app.secret_key = "gps_tracking_session_key"
-app.permanent_session_lifetime = timedelta(hours=1)
 
 # ─── Load building list ────────────────────────────────────────────────────
-b2n = json.load(open(os.path.join(os.path.dirname(__file__), "building_to_node_mapping.json")))
-BUILDINGS = list(b2n.keys())
-# also load building coordinates for nearest-building lookup
-BCOORDS = json.load(open(os.path.join(os.path.dirname(__file__), "building_coordinates_all.json")))
+# Parsed by the same cached loader compute_route() uses. Everything derived
+# from it is (re)built here, at import and again by /flush.
+from generate_directions_with_feet import load_data
+
+def load_buildings():
+    global b2n, BCOORDS, BUILDINGS, BCOORDS_NAMES, BCOORDS_XY
+    global BUILDING_CHOICES, BUILDINGS_CF, BUILDINGS_BY_LOWER, BUILDINGS_LOWER
+    b2n, BCOORDS = load_data()
+    BUILDINGS = list(b2n.keys())
+    # ...and as parallel name list / (N,2) array for vectorized lookups
+    BCOORDS_NAMES = list(BCOORDS.keys())
+    BCOORDS_XY = np.asarray(list(BCOORDS.values()), dtype=float)
+
+    # Lowercased once here; passing a mapping makes extractOne return the
+    # original building name as the key.
+    BUILDING_CHOICES = {b: b.lower() for b in BUILDINGS}
+    # Case-insensitive exact names, checked before any scanning
+    BUILDINGS_CF = {b.casefold(): b for b in BUILDINGS}
+    # Sorted lowercased names (with originals alongside) for bisect prefix lookups
+    BUILDINGS_BY_LOWER = sorted((b.lower(), b) for b in BUILDINGS)
+    BUILDINGS_LOWER = [low for low, _ in BUILDINGS_BY_LOWER]
+
+load_buildings()
 # ────────────────────────────────────────────────────────────────────────────
 
 
@@ -67,18 +105,27 @@ def gps_to_pixel(lat, lon):
     """
     # 1) exact inverse
     xy = mapper.gps_to_pixel(lat, lon)
-    if xy is not None:
-        return int(round(xy[0])), int(round(xy[1]))
-
-    # 2) fallback: nearest GPS anchor
-    gps_array = mapper.gps_pts   # shape (N,2): [ [lat, lon], ... ]
-    deltas = gps_array - np.array([lat, lon])
-    d2 = np.sum(deltas * deltas, axis=1)
-    idx = int(np.argmin(d2))
-
-    pixel_array = mapper.pixel_pts  # shape (N,2): [ [x, y], ... ]
-    x_anchor, y_anchor = pixel_array[idx]
-    return int(round(x_anchor)), int(round(y_anchor))
+    if xy is None:
+        # 2) fallback: nearest GPS anchor
+        _, idx = GPS_TREE.query((lat, lon))
+        xy = PIXEL_PTS_LIST[idx]
+    # round() on plain floats rounds half to even like np.rint, without
+    # building an array for two numbers
+    return round(xy[0]), round(xy[1])
+
+def gps_to_pixel_batch(points):
+    """gps_to_pixel() for an (N,2) array of (lat, lon); returns an (N,2) int array."""
+    pts = np.asarray(points, dtype=np.float64)
+    if pts.ndim != 2 or pts.shape[1] != 2:
+        raise ValueError(f"expected an (N, 2) array of (lat, lon), got shape {pts.shape}")
+    if not np.isfinite(pts).all():
+        raise ValueError("lat/lon must be finite")
+    xy = mapper.gps_to_pixel_many(pts)
+    outside = np.isnan(xy[:, 0])
+    if outside.any():
+        _, idx = GPS_TREE.query(pts[outside])
+        xy[outside] = PIXEL_PTS[idx]
+    return np.rint(xy).astype(np.int64)
 #
 # Helper used when we want to ensure the GPS point is actually inside
 # the calibrated area. Returns None if outside instead of falling back.
@@ -86,32 +133,61 @@ def gps_to_pixel_strict(lat, lon):
     xy = mapper.gps_to_pixel(lat, lon)
     if xy is None:
         return None
-    return int(round(xy[0])), int(round(xy[1]))
+    return round(xy[0]), round(xy[1])
 
 # Determine the closest known building to a given pixel (x, y)
 def nearest_building(x, y):
-    best = None
-    best_d2 = None
-    for b, (bx, by) in BCOORDS.items():
-        dx = bx - x
-        dy = by - y
-        d2 = dx * dx + dy * dy
-        if best_d2 is None or d2 < best_d2:
-            best = b
-            best_d2 = d2
-    return best
+    deltas = BCOORDS_XY - np.array([x, y], dtype=float)
+    d2 = np.einsum("ij,ij->i", deltas, deltas)
+    return BCOORDS_NAMES[int(np.argmin(d2))]
 # ────────────────────────────────────────────────────────────────────────────
 
 
-# ─── Fuzzy Matching (rapidfuzz or fuzzywuzzy) ─────────────────────────────────
-try:
-    from rapidfuzz import process
-except ImportError:
-    from fuzzywuzzy import process
+# ─── Fuzzy Matching (rapidfuzz) ─────────────────────────────────────────────
+from rapidfuzz import process, fuzz
+
+# BUILDING_CHOICES, BUILDINGS_CF and BUILDINGS_BY_LOWER/BUILDINGS_LOWER are
+# built by load_buildings() above.
 
+def prefix_buildings(q):
+    """Buildings whose lowercased name starts with q (already lowercased)."""
+    i = bisect.bisect_left(BUILDINGS_LOWER, q)
+    j = bisect.bisect_right(BUILDINGS_LOWER, q + "\uffff")
+    return [b for _, b in BUILDINGS_BY_LOWER[i:j]]
+
+@lru_cache(maxsize=512)
 def fuzzy_building(name):
-    match, score, _ = process.extractOne(name, BUILDINGS)
-    return match if score >= 60 else None
+    """
+    Cheapest stage first: exact name, then prefix match, then substring
+    match, and only then rapidfuzz. Among several prefix/substring hits the
+    shortest name (the closest to what was typed) wins.
+    """
+    exact = BUILDINGS_CF.get(name.strip().casefold())
+    if exact is not None:
+        return exact
+    q = name.strip().lower()
+    if q:
+        hits = prefix_buildings(q) or [b for b, low in BUILDING_CHOICES.items() if q in low]
+        if hits:
+            return min(hits, key=len)
+    res = process.extractOne(q, BUILDING_CHOICES, scorer=fuzz.WRatio, score_cutoff=60)
+    return res[2] if res else None
+
+SUGGEST_LIMIT = 5
+
+@lru_cache(maxsize=1024)
+def suggest_buildings(q):
+    """Top building names for a partial query, for typeahead."""
+    q = q.strip().lower()
+    if not q:
+        return ()
+    hits = prefix_buildings(q)[:SUGGEST_LIMIT]
+    if len(hits) < SUGGEST_LIMIT:
+        for _, _, b in process.extract(q, BUILDING_CHOICES, scorer=fuzz.WRatio,
+                                       limit=SUGGEST_LIMIT, score_cutoff=60):
+            if b not in hits:
+                hits.append(b)
+    return tuple(hits[:SUGGEST_LIMIT])
 # ────────────────────────────────────────────────────────────────────────────
 
 
@@ -133,50 +209,268 @@ def find_ollama_executable():
 
 OLLAMA_EXE   = find_ollama_executable()
 OLLAMA_IMAGE = "gemma3:1b"
+OLLAMA_URL   = "http://localhost:11434/api/generate"
+
+# One keep-alive client for the whole process, so every polish request reuses
+# the same connection to the Ollama daemon (which keeps the model resident)
+# instead of forking a fresh `ollama run` each time.
+OLLAMA_CLIENT = httpx.Client(
+    timeout=httpx.Timeout(300.0, connect=10.0),
+    limits=httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30.0),
+)
 
-def polish_with_ollama(feet_lines):
-    if not OLLAMA_EXE:
-        # No Ollama binary—skip
-        return None
+# How many generations the daemon runs at once (Ollama's own setting of the
+# same name); extra requests wait here instead of queueing inside Ollama.
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+OLLAMA_SLOTS = threading.BoundedSemaphore(OLLAMA_NUM_PARALLEL)
+
+# Keep the model loaded in the daemon: one empty generate call loads the
+# weights without producing text, and repeating it before keep_alive runs out
+# means the first real request never pays the load.
+OLLAMA_KEEP_ALIVE = "1h"
+OLLAMA_WARM_INTERVAL = 30 * 60  # seconds
 
-    prompt = (
+def warm_ollama():
+    try:
+        OLLAMA_CLIENT.post(
+            OLLAMA_URL,
+            json={"model": OLLAMA_IMAGE, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE},
+            timeout=120.0,
+        ).raise_for_status()
+        print(f"[🔥] {OLLAMA_IMAGE} loaded in the Ollama daemon.")
+    except httpx.HTTPError as e:
+        print(f"[⚠️] Could not warm up Ollama ({e}).")
+    timer = threading.Timer(OLLAMA_WARM_INTERVAL, warm_ollama)
+    timer.daemon = True
+    timer.start()
+
+# Off the import path, so a slow model load doesn't hold up startup
+threading.Thread(target=warm_ollama, daemon=True).start()
+
+def build_prompt(feet_lines):
+    return (
         "You are a helpful and friendly assistant.\n"
         "Rewrite the following step-by-step walking directions into a cohesive, natural paragraph "
         "that sounds like something a real person would say. Use full sentences.\n\n"
         + "\n".join(feet_lines)
     )
 
+# Polished paragraphs of recently requested routes, keyed by the tuple of
+# feet lines (identical routes give identical lines, hence identical text).
+# Only complete generations are stored.
+POLISH_CACHE_SIZE = 512
+_polish_cache = OrderedDict()
+_polish_cache_lock = threading.Lock()
+
+def _cached_polish(key):
+    with _polish_cache_lock:
+        text = _polish_cache.get(key)
+        if text is not None:
+            _polish_cache.move_to_end(key)
+        return text
+
+def _remember_polish(key, text):
+    if not text:
+        return
+    with _polish_cache_lock:
+        _polish_cache[key] = text
+        _polish_cache.move_to_end(key)
+        while len(_polish_cache) > POLISH_CACHE_SIZE:
+            _polish_cache.popitem(last=False)
+
+def polish_with_ollama(feet_lines):
+    """
+    Yield the polished paragraph piece by piece as Ollama generates it, so
+    the page can be flushed to the browser before generation finishes.
+    Repeat routes are served from an LRU cache in a single chunk.
+    Yields nothing if no Ollama is available.
+    """
+    key = tuple(feet_lines)
+    cached = _cached_polish(key)
+    if cached is not None:
+        yield cached
+        return
+
+    # Hold one of the daemon's parallel slots for the whole generation
+    with OLLAMA_SLOTS:
+        prompt = build_prompt(feet_lines)
+
+        # 1) Preferred: the streaming (NDJSON) Ollama HTTP API on the local daemon
+        streamed = False
+        parts = []
+        try:
+            with OLLAMA_CLIENT.stream(
+                "POST",
+                OLLAMA_URL,
+                json={"model": OLLAMA_IMAGE, "prompt": prompt, "stream": True,
+                      "keep_alive": OLLAMA_KEEP_ALIVE},
+            ) as resp:
+                resp.raise_for_status()
+                for line in resp.iter_lines():
+                    if not line:
+                        continue
+                    chunk = orjson.loads(line)
+                    if chunk.get("response"):
+                        streamed = True
+                        parts.append(chunk["response"])
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        break
+            print("[✅] Ollama polish complete.")
+            _remember_polish(key, "".join(parts))
+            return
+        except httpx.HTTPError as e:
+            if streamed:
+                # Part of the paragraph is already on its way to the browser
+                print(f"[🔥] Ollama stream interrupted: {e}")
+                return
+            print(f"[⚠️] Ollama daemon unavailable ({e}); trying the CLI.")
+        except ValueError as e:
+            print("[❗] Unexpected response from Ollama:", e)
+            return
+
+        # 2) No daemon reachable: fall back to spawning the CLI, which
+        # streams its stdout to us as well
+        polished = yield from polish_with_ollama_cli(prompt)
+        if polished:
+            _remember_polish(key, polished)
+
+def polish_with_ollama_cli(prompt):
+    """
+    Generator over the CLI's output as it is printed. Its return value (the
+    value of `yield from`) is the whole paragraph, or None on failure.
+    """
+    if not OLLAMA_EXE:
+        # No Ollama binary—skip
+        return None
+
     if OLLAMA_EXE == "ollama":
         # Native WSL
-        cmd = [OLLAMA_EXE, "run", OLLAMA_IMAGE]
+        cmd = [OLLAMA_EXE, "run", "--keepalive", OLLAMA_KEEP_ALIVE, OLLAMA_IMAGE]
         input_data = prompt.encode("utf-8")
 
     else:
-        # Windows fallback via PowerShell
-        # We need to escape quotes inside the prompt for PowerShell
-        safe_prompt = prompt.replace("\\", "\\\\").replace('"', '`"')
-        script = f"echo \"{safe_prompt}\" | ollama run {OLLAMA_IMAGE}"
-        cmd = [OLLAMA_EXE, "-Command", script]
-        input_data = None
+        # Windows fallback via PowerShell: the prompt goes in on stdin, so
+        # only the fixed pipeline needs encoding and nothing is escaped
+        script = f"$input | ollama run --keepalive {OLLAMA_KEEP_ALIVE} {OLLAMA_IMAGE}"
+        encoded = base64.b64encode(script.encode("utf-16-le")).decode("ascii")
+        cmd = [OLLAMA_EXE, "-NoProfile", "-EncodedCommand", encoded]
+        input_data = prompt.encode("utf-8")
 
     print(f"[🚀] Running: {' '.join(cmd)}")
     try:
-        proc = subprocess.run(
+        proc = subprocess.Popen(
             cmd,
-            input=input_data,
-            capture_output=True,
-            check=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             shell=False
         )
-        print("[✅] Ollama polish complete.")
-        return proc.stdout.decode("utf-8").strip()
-    except subprocess.CalledProcessError as e:
-        print(f"[🔥] Ollama failed (exit code {e.returncode})")
-        print("[stderr]:", e.stderr.decode())
-        return None
-    except Exception as e:
+    except OSError as e:
         print("[❗] Unexpected error calling Ollama:", e)
         return None
+
+    parts = []
+    try:
+        # The prompt is far smaller than a pipe buffer, so this can't block
+        proc.stdin.write(input_data)
+        proc.stdin.close()
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = proc.stdout.read1(4096)
+            text = decoder.decode(data, final=not data)
+            if not parts:
+                text = text.lstrip()
+            if text:
+                parts.append(text)
+                yield text
+            if not data:
+                break
+
+        stderr = proc.stderr.read()
+        returncode = proc.wait()
+    finally:
+        # Also reached when the reader goes away mid-generation
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        for pipe in (proc.stdin, proc.stdout, proc.stderr):
+            pipe.close()
+
+    if returncode != 0:
+        print(f"[🔥] Ollama failed (exit code {returncode})")
+        print("[stderr]:", stderr.decode(errors="replace"))
+        return None
+    print("[✅] Ollama polish complete.")
+    return "".join(parts).strip()
+
+class _PolishJob:
+    """One in-flight generation whose chunks any number of requests can read."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.cond = threading.Condition()
+
+    def put(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                if i >= len(self.chunks):
+                    return
+                chunk = self.chunks[i]
+            i += 1
+            yield chunk
+
+# Generations currently running, keyed like _polish_cache
+_polish_jobs = {}
+_polish_jobs_lock = threading.Lock()
+
+# Worker threads for polish jobs, reused across requests; beyond
+# OLLAMA_NUM_PARALLEL they only wait on OLLAMA_SLOTS anyway.
+POLISH_EXECUTOR = ThreadPoolExecutor(max_workers=4 * OLLAMA_NUM_PARALLEL, thread_name_prefix="polish")
+
+def polish_in_background(feet_lines):
+    """
+    Start polish_with_ollama() on a pool thread right away and return a
+    generator over its chunks, so generation overlaps whatever the request
+    does next (drawing the overlay) instead of starting once the template
+    reaches the Polished box.
+
+    Concurrent requests for the same route share one generation rather than
+    each sending the same prompt to the daemon.
+    """
+    key = tuple(feet_lines)
+    with _polish_jobs_lock:
+        job = _polish_jobs.get(key)
+        if job is None:
+            job = _polish_jobs[key] = _PolishJob()
+            POLISH_EXECUTOR.submit(_run_polish_job, key, job)
+    return iter(job)
+
+def _run_polish_job(key, job):
+    try:
+        for chunk in polish_with_ollama(key):
+            job.put(chunk)
+    finally:
+        # Unregister before finishing so a request arriving afterwards goes
+        # to the cache instead of reading a completed job
+        with _polish_jobs_lock:
+            _polish_jobs.pop(key, None)
+        job.finish()
 # ────────────────────────────────────────────────────────────────────────────
 
 
@@ -187,16 +481,167 @@ def polish_with_ollama(feet_lines):
 #     HTML = """<!doctype html> <html> ... </html>"""
 #
 from html_template import HTML
+
+# Compiled once in Flask's environment; stream_template_string() would lex
+# and parse the whole page again on every request.
+INDEX_TEMPLATE = app.jinja_env.from_string(HTML)
+# ────────────────────────────────────────────────────────────────────────────
+
+
+# ─── Routing + overlay drawing ─────────────────────────────────────────────
+from generate_directions_with_feet import INPUT_MAP, compute_route, draw_overlay, load_graph, load_index, simplify_path
+
+# Rendered overlays, one PNG per route, so repeat routes are a plain file
+# send instead of a redraw of the full-size map. Each is a full-resolution
+# PNG, so only the OVERLAY_MAX most recently used are kept (LRU by mtime).
+OVERLAY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "overlays")
+os.makedirs(OVERLAY_DIR, exist_ok=True)
+OVERLAY_MAX = int(os.environ.get("OVERLAY_MAX", "100"))
+_overlay_evict_lock = threading.Lock()
+
+def evict_overlays(keep=OVERLAY_MAX):
+    """Delete the least recently used finished overlays beyond ``keep``."""
+    with _overlay_evict_lock:
+        files = []
+        for entry in os.scandir(OVERLAY_DIR):
+            if entry.name.endswith(".tmp.png"):
+                continue  # still being drawn by another request
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+        if len(files) <= keep:
+            return
+        files.sort()
+        for _, path in files[:len(files) - keep]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def overlay_for(start, end, path, landmarks):
+    """Return the file name of the overlay for this route, drawing it on a miss."""
+    # Named by content, not just by endpoints, so a URL never changes meaning
+    # and the PNG can be cached as immutable.
+    key = orjson.dumps([start, end, path, landmarks])
+    name = hashlib.md5(key).hexdigest() + ".png"
+    out = os.path.join(OVERLAY_DIR, name)
+    if not os.path.exists(out):
+        # Draw under a private name, then swap it in, so a concurrent request
+        # never serves a half-written PNG.
+        tmp = os.path.join(OVERLAY_DIR, f"{name[:-4]}.{os.getpid()}-{threading.get_ident()}.tmp.png")
+        draw_overlay(path, landmarks, BCOORDS, out=tmp)
+        os.replace(tmp, out)
+        evict_overlays()
+    else:
+        try:
+            os.utime(out)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted meanwhile; the next request redraws it
+    return name
+# ────────────────────────────────────────────────────────────────────────────
+
+
+# ─── Per-client GPS store ──────────────────────────────────────────────────
+# Each browser gets an opaque "sid" cookie once; its latest fix lives here
+# rather than in the signed session cookie, which would be re-signed and
+# re-sent on every /update_location ping. Fixes are per process, so run a
+# single worker (see wsgi.py).
+#
+# Pings from a known client are a plain last-write-wins assignment (atomic
+# under the GIL); only a new client takes the lock, to insert and evict the
+# oldest clients once the store is full.
+#
+# watchPosition can fire every second while the phone barely moves, so a
+# fix is only stored if it moved GPS_MIN_MOVE metres or GPS_MIN_INTERVAL
+# seconds have passed since the stored one.
+SID_COOKIE = "sid"
+SID_MAX_AGE = 60 * 60  # seconds
+GPS_STORE_SIZE = 4096
+GPS_MIN_MOVE = 3.0       # metres
+GPS_MIN_INTERVAL = 2.0   # seconds
+_gps_by_sid = OrderedDict()   # sid -> (lat, lon, time stored), least recently updated first
+_gps_lock = threading.Lock()
+
+# Bumped on every stored fix, so /location_stream can sleep until one arrives
+_gps_version = 0
+_gps_changed = threading.Condition()
+
+def _gps_stored():
+    global _gps_version
+    with _gps_changed:
+        _gps_version += 1
+        _gps_changed.notify_all()
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6371000.0 * math.asin(math.sqrt(a))
+
+def get_gps(sid):
+    fix = _gps_by_sid.get(sid)
+    return fix[:2] if fix else None
+
+def set_gps(sid, lat, lon):
+    """Store a fix for this client; returns False if it was gated out."""
+    now = time.monotonic()
+    with _gps_lock:
+        last = _gps_by_sid.get(sid)
+        if last is not None:
+            # Eviction is least recently updated first, so a client still
+            # sending fixes moves to the back even when the fix is gated out
+            _gps_by_sid.move_to_end(sid)
+            last_lat, last_lon, last_t = last
+            if (lat, lon) == (last_lat, last_lon):
+                # Phones resend the same fix often
+                return False
+            if now - last_t < GPS_MIN_INTERVAL and haversine_m(last_lat, last_lon, lat, lon) < GPS_MIN_MOVE:
+                return False
+        _gps_by_sid[sid] = (lat, lon, now)
+        while len(_gps_by_sid) > GPS_STORE_SIZE:
+            _gps_by_sid.popitem(last=False)
+    _gps_stored()
+    return True
+
+@app.before_request
+def load_sid():
+    g.sid = request.cookies.get(SID_COOKIE)
+    g.new_sid = g.sid is None
+    if g.new_sid:
+        g.sid = secrets.token_urlsafe(16)
+
+@app.after_request
+def save_sid(resp):
+    if g.get("new_sid"):
+        resp.set_cookie(SID_COOKIE, g.sid, max_age=SID_MAX_AGE, httponly=True, samesite="Lax")
+    return resp
 # ────────────────────────────────────────────────────────────────────────────
 
 
 # ─── Routes ───────────────────────────────────────────────────────────────
+# JSON in and out through orjson: /update_location and /get_location are hit
+# every second or two by every open page.
+def json_response(obj, status=200):
+    return app.response_class(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def request_json():
+    """The request body parsed as a JSON object, {} if empty or malformed."""
+    try:
+        data = orjson.loads(request.get_data(cache=False) or b"{}")
+    except orjson.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
 @app.route("/", methods=["GET", "POST"])
 def index():
-    error = raw = polished = None
+    error = raw = None
+    polished = ()
     used_gps_start = None
 
     path_json = None
+    overlay = None
     show_start = False
 
     if request.method == "POST":
@@ -206,16 +651,16 @@ def index():
 
         start_building = None
         if use_current:
-            gps = session.get("gps")
+            gps = get_gps(g.sid)
             if not gps:
                 error = "Current location unavailable."
             else:
                 # First attempt strict conversion. If that fails, fall back to
                 # the approximate mapping and only report off-campus if that
                 # also fails (very unlikely).
-                xy = gps_to_pixel_strict(gps["lat"], gps["lon"])
+                xy = gps_to_pixel_strict(*gps)
                 if xy is None:
-                    xy = gps_to_pixel(gps["lat"], gps["lon"])
+                    xy = gps_to_pixel(*gps)
                 if xy is None:
                     error = "You appear to be off campus."
                 else:
@@ -229,24 +674,23 @@ def index():
             if not start_building or not end_building:
                 error = f"Could not match “{request.form.get('start','')}” or “{b}” to campus buildings."
             else:
-                from generate_directions_with_feet import compute_route, draw_overlay
-
                 pix, feet, path, landmarks = compute_route(start_building, end_building)
                 raw = "\n".join(feet)
 
-                draw_overlay(
-                    path,
-                    landmarks,
-                    BCOORDS
-                )
+                # Kick off the LLM first; the overlay is drawn while it generates.
+                polished = polish_in_background(feet)
+                overlay = overlay_for(start_building, end_building, path, landmarks)
 
-                polished = polish_with_ollama(feet)
-                path_json = json.dumps(path, default=lambda o: int(o) if isinstance(o, np.integer) else str(o))
+                # The client only draws and scans the polyline; 1 px of error is invisible.
+                # Sent flat ([x0, y0, x1, y1, ...]) for a Float32Array on the page.
+                path_json = orjson.dumps([c for xy in simplify_path(path, epsilon=1.0) for c in xy]).decode()
                 show_start = use_current
 
 
-    return render_template_string(
-        HTML,
+    # Streamed so the raw directions reach the browser right away while the
+    # polished paragraph is still being generated.
+    return stream_template(
+        INDEX_TEMPLATE,
         error=error,
         raw=raw,
         polished=polished,
@@ -254,45 +698,169 @@ def index():
         buildings=BUILDINGS,
         used_gps_start=used_gps_start,
         path_json=path_json,
+        overlay=overlay,
         show_start=show_start,
+        map_version=map_version(),
     )
 
 
-@app.route("/route_overlay.png")
-def overlay():
-    # Serve the dynamically overwritten overlay
-    return send_from_directory(".", "route_overlay.png")
+# Image URLs are versioned by content (overlay file names, ?v= on the base
+# map), so browsers may keep them for a year without revalidating.
+IMAGE_MAX_AGE = 31536000  # seconds
+
+def immutable(resp):
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+@lru_cache(maxsize=1)
+def map_version():
+    """Cache-busting token for the base map; changes when the file does."""
+    st = os.stat(INPUT_MAP)
+    return hashlib.md5(f"{st.st_mtime_ns}:{st.st_size}".encode()).hexdigest()[:12]
+
+@app.route("/overlays/<name>")
+def overlay_png(name):
+    return immutable(send_from_directory(OVERLAY_DIR, name, conditional=True, max_age=IMAGE_MAX_AGE))
+
+
+@app.route("/suggest")
+def suggest():
+    return json_response(suggest_buildings(request.args.get("q", "")))
 
 
 @app.route("/trinity_map_original.png")
 def original_map():
-    return send_from_directory(".", "trinity_map_original.png")
+    return immutable(send_from_directory(".", "trinity_map_original.png", conditional=True, max_age=IMAGE_MAX_AGE))
+
+
+# /flush needs an X-Flush-Token header: equal to $FLUSH_TOKEN if that is set,
+# otherwise any value but only from localhost. Browsers cannot add custom
+# headers to cross-site requests, so a page elsewhere cannot trigger it.
+FLUSH_TOKEN = os.environ.get("FLUSH_TOKEN")
+
+@app.route("/flush", methods=["POST"])
+def flush():
+    # Drop memoized routes/matches/polish text and reload the building data,
+    # e.g. after editing the building JSON files.
+    token = request.headers.get("X-Flush-Token", "")
+    if FLUSH_TOKEN:
+        if not secrets.compare_digest(token, FLUSH_TOKEN):
+            return "Forbidden", 403
+    elif request.remote_addr not in ("127.0.0.1", "::1") or not token:
+        return "Forbidden", 403
+    fuzzy_building.cache_clear()
+    suggest_buildings.cache_clear()
+    compute_route.cache_clear()
+    map_version.cache_clear()
+    load_data.cache_clear()
+    load_graph.cache_clear()
+    load_index.cache_clear()
+    with _polish_cache_lock:
+        _polish_cache.clear()
+    load_buildings()
+    # Overlays are kept: they are named by route content, so changed data
+    # produces new names, and old ones may still be cached under their URLs.
+    return "OK"
 
 
 @app.route("/update_location", methods=["POST"])
 def update_location():
-    data = request.get_json(force=True) or {}
-    lat = data.get("lat")
-    lon = data.get("lon")
-    if lat is not None and lon is not None:
-        session["gps"] = {"lat": lat, "lon": lon}
+    data = request_json()
+    try:
+        lat = float(data["lat"])
+        lon = float(data["lon"])
+    except (KeyError, TypeError, ValueError):
+        return "OK"
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        # float() accepts "nan"/"inf", which the KD-tree fallback cannot map
+        return "OK"
+    if not set_gps(g.sid, lat, lon):
+        return "OK"
     print(f"📍 Received GPS coords: lat={lat}, lon={lon}")
     return "OK"
 
 
 @app.route("/get_location")
 def get_location():
-    gps = session.get("gps")
+    gps = get_gps(g.sid)
     if not gps:
-        return jsonify(x=None, y=None)
-
-    x, y = gps_to_pixel(gps["lat"], gps["lon"])
-    print(f"📍 Converting GPS ({gps['lat']}, {gps['lon']}) → Pixel ({x}, {y})")
-    return jsonify(x=x, y=y)
+        return json_response({"x": None, "y": None})
+
+    lat, lon = gps
+    x, y = gps_to_pixel(lat, lon)
+    print(f"📍 Converting GPS ({lat}, {lon}) → Pixel ({x}, {y})")
+    return json_response({"x": x, "y": y})
+
+
+# Each open map holds one of these streams (and so one server thread), so
+# they end after a while and the browser's EventSource reconnects.
+LOCATION_STREAM_SECONDS = 5 * 60
+LOCATION_KEEPALIVE = 15  # seconds between comments when nothing moves
+# Streams beyond this get a 503 and the page falls back to polling, so open
+# maps can never take every server thread (keep it below gunicorn --threads).
+LOCATION_STREAMS_MAX = int(os.environ.get("LOCATION_STREAMS_MAX", "16"))
+_location_streams = threading.BoundedSemaphore(LOCATION_STREAMS_MAX)
+
+@app.route("/location_stream")
+def location_stream():
+    # Server-sent events: {"x", "y"} pushed whenever this client's fix changes,
+    # instead of the page polling /get_location every second.
+    sid = g.sid
+    if not _location_streams.acquire(blocking=False):
+        return Response("Too many location streams", status=503, headers={"Retry-After": "60"})
+
+    def events():
+        deadline = time.monotonic() + LOCATION_STREAM_SECONDS
+        yield "retry: 1000\n\n"
+        last = None
+        while True:
+            seen = _gps_version
+            gps = get_gps(sid)
+            if gps is not None and gps != last:
+                last = gps
+                x, y = gps_to_pixel(*gps)
+                yield f"data: {orjson.dumps({'x': x, 'y': y}).decode()}\n\n"
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            with _gps_changed:
+                moved = _gps_changed.wait_for(lambda: _gps_version != seen,
+                                              timeout=min(remaining, LOCATION_KEEPALIVE))
+            if not moved:
+                # Keeps proxies from closing an idle stream and notices
+                # a client that has gone away
+                yield ": keepalive\n\n"
+
+    resp = Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Runs when the server closes the response, even if it never started iterating
+    resp.call_on_close(_location_streams.release)
+    return resp
+
+
+# Largest batch /get_location_batch converts in one request
+LOCATION_BATCH_MAX = int(os.environ.get("LOCATION_BATCH_MAX", "10000"))
+
+
+@app.route("/get_location_batch", methods=["POST"])
+def get_location_batch():
+    # {"points": [[lat, lon], ...]} → {"xy": [[x, y], ...]}, converted in one go
+    data = request_json()
+    points = data.get("points") or []
+    if isinstance(points, list) and len(points) > LOCATION_BATCH_MAX:
+        return json_response(
+            {"error": f"at most {LOCATION_BATCH_MAX} points per request"}, 413)
+    try:
+        xy = gps_to_pixel_batch(points) if points else np.empty((0, 2), dtype=np.int64)
+    except (TypeError, ValueError):
+        return json_response({"error": "points must be a list of [lat, lon] pairs"}, 400)
+    return json_response({"xy": xy.tolist()})
 # ────────────────────────────────────────────────────────────────────────────
 
 
 # ─── Main ──────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
+    # Development server only; for real use run it under gunicorn (see wsgi.py).
     # Note: we bind to 0.0.0.0 so your phone on the same LAN can connect
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000, threaded=True)
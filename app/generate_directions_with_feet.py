@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
-import pickle, json, numpy as np, networkx as nx, math, cv2, sys
-from scipy.spatial import KDTree
+import os, pickle, orjson, numpy as np, math, cv2, sys
+from functools import lru_cache
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 
 # ─── CONFIG ──────────────────────────────────────────────────────────────
-GRAPH_PKL        = "trinity_path_graph.gpickle"
-BUILDING_MAP     = "building_to_node_mapping.json"
-BUILDING_COORDS  = "building_coordinates_all.json"
-INPUT_MAP        = "trinity_map_original.png"
+HERE             = os.path.dirname(os.path.abspath(__file__))
+GRAPH_PKL        = os.path.join(HERE, "trinity_path_graph.gpickle")
+GRAPH_CSR        = os.path.join(HERE, "trinity_path_graph_csr.npz")
+GRAPH_TREE       = os.path.join(HERE, "trinity_path_graph_tree.pkl")
+BUILDING_MAP     = os.path.join(HERE, "building_to_node_mapping.json")
+BUILDING_COORDS  = os.path.join(HERE, "building_coordinates_all.json")
+INPUT_MAP        = os.path.join(HERE, "trinity_map_original.png")
 
 NODE_LIST_OUT    = "path_nodes.txt"
 INSTR_PIX_OUT    = "instructions_pixels.txt"
@@ -22,50 +28,154 @@ CALIBRATION = [
 ]
 # ─────────────────────────────────────────────────────────────────────────
 
-def calibrate_factor():
-    return sum(feet / math.hypot(x2 - x1, y2 - y1) for (x1, y1), (x2, y2), feet in CALIBRATION) / len(CALIBRATION)
+def calibrate_factor(calibration=CALIBRATION):
+    p1   = np.array([c[0] for c in calibration], dtype=float)
+    p2   = np.array([c[1] for c in calibration], dtype=float)
+    feet = np.array([c[2] for c in calibration], dtype=float)
+    return float(np.mean(feet / np.linalg.norm(p2 - p1, axis=1)))
 
+# Feet per pixel; CALIBRATION is constant, so compute it once
+FACTOR = calibrate_factor()
+
+# Read once per process; compute_route() used to reload the data files on
+# every cache miss. Callers must treat the returned objects as read-only.
+@lru_cache(maxsize=1)
 def load_data():
-    G       = pickle.load(open(GRAPH_PKL, "rb"))
-    b2n     = json.load(open(BUILDING_MAP))
-    bcoords = json.load(open(BUILDING_COORDS))
-    return G, b2n, bcoords
-
-def find_route(G, b2n, start, end):
-    nodes = [tuple(map(int, n)) for n in G.nodes()]
-    tree  = KDTree(nodes)
+    with open(BUILDING_MAP, "rb") as f:
+        b2n = orjson.loads(f.read())
+    with open(BUILDING_COORDS, "rb") as f:
+        bcoords = orjson.loads(f.read())
+    return b2n, bcoords
+
+# The networkx graph is only needed when the CSR file is missing or stale,
+# so it is unpickled on demand rather than with the building data.
+@lru_cache(maxsize=1)
+def load_graph():
+    with open(GRAPH_PKL, "rb") as f:
+        return pickle.load(f)
+
+def load_csr():
+    """
+    (nodes, csr) saved next to the graph by extract_and_save_path_graph.py, or
+    None if that file is missing or older than the pickle. Deployments may
+    ship the CSR file without the pickle.
+    """
+    if not os.path.exists(GRAPH_CSR) or (
+        os.path.exists(GRAPH_PKL) and os.path.getmtime(GRAPH_CSR) < os.path.getmtime(GRAPH_PKL)
+    ):
+        return None
+    with np.load(GRAPH_CSR) as z:
+        n = len(z["nodes"])
+        csr = csr_matrix((z["data"], z["indices"], z["indptr"]), shape=(n, n))
+        return z["nodes"].astype(np.int32, copy=False), csr
+
+def load_node_tree(nodes):
+    """
+    The cKDTree over the CSR file's nodes, pickled by the extractor, or a
+    fresh build if that file is missing, stale or for a different node set.
+    """
+    if os.path.exists(GRAPH_TREE) and (
+        not os.path.exists(GRAPH_CSR) or os.path.getmtime(GRAPH_TREE) >= os.path.getmtime(GRAPH_CSR)
+    ):
+        with open(GRAPH_TREE, "rb") as f:
+            tree = pickle.load(f)
+        # Query results are indexes into nodes, so the tree must hold exactly
+        # these points in this order, not just the same number of them
+        if tree.n == len(nodes) and np.array_equal(tree.data, nodes):
+            return tree
+    return cKDTree(nodes)
+
+# Spatial indexes and a CSR copy of the graph (node i ↔ nodes[i], an (N,2)
+# int32 array) for SciPy's C Dijkstra, built once instead of per route.
+@lru_cache(maxsize=1)
+def load_index():
+    _, bcoords = load_data()
+    saved = load_csr()
+    if saved:
+        nodes, csr = saved
+        tree = load_node_tree(nodes)
+    else:
+        G       = load_graph()
+        ids     = {n: i for i, n in enumerate(G.nodes())}
+        nodes   = np.array(list(ids), dtype=np.int32).reshape(-1, 2)
+        edges   = [(ids[u], ids[v], d.get("weight", 1.0)) for u, v, d in G.edges(data=True)]
+        rows, cols, weights = zip(*edges) if edges else ((), (), ())
+        csr     = csr_matrix((weights, (rows, cols)), shape=(len(nodes), len(nodes)))
+        tree    = cKDTree(nodes)
+    names   = list(bcoords.keys())
+    pts     = np.array([bcoords[n] for n in names])
+    return nodes, tree, names, cKDTree(pts), csr
+
+def find_route(b2n, start, end):
+    nodes, tree, _, _, csr = load_index()
     if start not in b2n or end not in b2n:
         raise ValueError(f"Start or end building not found: {start}, {end}")
-    sx, sy = b2n[start]; ex, ey = b2n[end]
-    _, si = tree.query((sx, sy))
-    _, ei = tree.query((ex, ey))
-    src, dst = nodes[si], nodes[ei]
-    if not nx.has_path(G, src, dst):
+    _, (si, ei) = tree.query([b2n[start], b2n[end]])
+    dist, pred = dijkstra(csr, directed=False, indices=si, return_predecessors=True)
+    if not np.isfinite(dist[ei]):
         raise RuntimeError(f"No path found between '{start}' and '{end}'")
-    return nx.shortest_path(G, src, dst, weight="weight")
+    path = [ei]
+    while path[-1] != si:
+        path.append(pred[path[-1]])
+    return [tuple(p) for p in nodes[path[::-1]].tolist()]
+
+def simplify_path(path, epsilon=1.0):
+    """
+    Ramer–Douglas–Peucker: drop path nodes that lie within ``epsilon`` pixels
+    of the line between the nodes kept around them. Grid routes are mostly
+    collinear runs, so this shrinks what the browser has to draw and scan.
+    Iterative, so long paths cannot hit the recursion limit.
+    """
+    P = np.asarray(path).reshape(-1, 2)
+    n = len(P)
+    if n < 3:
+        return P.tolist()
+    F = P.astype(np.float64)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        dx, dy = F[j] - F[i]
+        rel = F[i + 1:j] - F[i]
+        norm = math.hypot(dx, dy)
+        if norm:
+            dist = np.abs(dx * rel[:, 1] - dy * rel[:, 0]) / norm
+        else:   # closed loop: distance to the shared endpoint
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        k = int(np.argmax(dist))
+        if dist[k] > epsilon:
+            m = i + 1 + k
+            keep[m] = True
+            stack += [(i, m), (m, j)]
+    return P[keep].tolist()
 
 def save_node_list(path):
-    with open(NODE_LIST_OUT, "w") as f:
-        for x, y in path:
-            f.write(f"{x},{y}\n")
-
-def extract_landmarks(path, bcoords):
-    names = list(bcoords.keys())
-    pts   = np.array([bcoords[n] for n in names])
-    tree  = KDTree(pts)
-    seen  = {}
-    for i, (x, y) in enumerate(path):
-        dist, idx = tree.query((x, y))
-        if dist <= LANDMARK_RADIUS:
-            nm = names[idx]
-            if nm not in seen:
-                seen[nm] = i
-    return sorted(seen.items(), key=lambda kv: kv[1])
+    np.savetxt(NODE_LIST_OUT, np.asarray(path, dtype=np.int32).reshape(-1, 2), fmt="%d", delimiter=",")
+
+def extract_landmarks(path):
+    _, _, names, tree, _ = load_index()
+    # Nearest building for every path node in one query; keep each building
+    # at the first node that passes within LANDMARK_RADIUS of it.
+    dists, idxs = tree.query(np.asarray(path, dtype=np.float64), workers=-1)
+    near = np.flatnonzero(dists <= LANDMARK_RADIUS)
+    hit, first = np.unique(idxs[near], return_index=True)
+    return sorted(((names[b], int(near[f])) for b, f in zip(hit, first)), key=lambda kv: kv[1])
+
+# 2-bit code: high bit = vertical leg, low bit = negative-going (west / north)
+DIRECTIONS = ("east", "west", "south", "north")
+
+def direction_codes(dx, dy):
+    """Index into DIRECTIONS for each (dx, dy); branchless, scalars or arrays."""
+    dx, dy = np.asarray(dx), np.asarray(dy)
+    vert = np.abs(dx) <= np.abs(dy)
+    neg = (vert & (dy <= 0)) | (~vert & (dx <= 0))
+    return vert.astype(np.int8) * 2 + neg.astype(np.int8)
 
 def direction(dx, dy):
-    return "east" if abs(dx) > abs(dy) and dx > 0 else \
-           "west" if abs(dx) > abs(dy) else \
-           "south" if dy > 0 else "north"
+    return DIRECTIONS[int(direction_codes(dx, dy))]
 
 def make_instructions(landmarks, bcoords, factor):
     pix_lines, ft_lines = [], []
@@ -74,13 +184,14 @@ def make_instructions(landmarks, bcoords, factor):
     first, _ = landmarks[0]
     pix_lines.append(f"Start at {first}.")
     ft_lines.append(f"Start at {first}.")
-    for (curr, _), (nxt, _) in zip(landmarks, landmarks[1:]):
-        x1, y1 = bcoords[curr]
-        x2, y2 = bcoords[nxt]
-        dx, dy = x2 - x1, y2 - y1
-        d_pix = math.hypot(dx, dy)
+    # Leg vectors and lengths for all consecutive landmark pairs at once
+    xy = np.asarray([bcoords[nm] for nm, _ in landmarks], dtype=np.float64).reshape(-1, 2)
+    legs = np.diff(xy, axis=0)
+    lengths = np.hypot(legs[:, 0], legs[:, 1])
+    codes = direction_codes(legs[:, 0], legs[:, 1])
+    for (nxt, _), d_pix, code in zip(landmarks[1:], lengths.tolist(), codes.tolist()):
         d_ft = d_pix * factor
-        dir_ = direction(dx, dy)
+        dir_ = DIRECTIONS[code]
         pix_lines.append(f"Then go {dir_} about {d_pix:.1f} pixels to {nxt}.")
         ft_lines.append(f"Then go {dir_} about {d_ft:.0f} feet to {nxt}.")
     last, _ = landmarks[-1]
@@ -88,34 +199,70 @@ def make_instructions(landmarks, bcoords, factor):
     ft_lines.append(f"Arrive at {last}.")
     return pix_lines, ft_lines
 
-def _dotted_line(img, a, b, color=(255, 0, 0), spacing=15):
-    """Draw a dotted line between ``a`` and ``b``."""
-    dist = int(math.hypot(b[0] - a[0], b[1] - a[1]))
-    for i in range(0, dist + 1, spacing):
-        t = i / dist if dist else 0
-        x = int(a[0] + (b[0] - a[0]) * t)
-        y = int(a[1] + (b[1] - a[1]) * t)
-        cv2.circle(img, (x, y), 3, color, -1)
+DOT_RADIUS = 3
+
+def _dot_stamp(radius=DOT_RADIUS):
+    """(M,2) [dx, dy] offsets of the pixels cv2.circle fills for a dot of this radius."""
+    size = 2 * radius + 1
+    canvas = np.zeros((size, size), np.uint8)
+    cv2.circle(canvas, (radius, radius), radius, 255, -1)
+    dy, dx = np.nonzero(canvas)
+    return np.stack([dx - radius, dy - radius], axis=1)
+
+DOT_STAMP = _dot_stamp()
 
+def _dotted_path(img, path, color=(255, 0, 0), spacing=15):
+    """
+    Draw a dotted line along every edge of ``path``: a dot every ``spacing``
+    pixels from each edge's start. All dot centres are computed at once and
+    stamped with one fancy-indexed write instead of a cv2.circle per dot.
+    """
+    P = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+    if len(P) < 2:
+        return
+    A, D = P[:-1], P[1:] - P[:-1]
+    dist = np.hypot(D[:, 0], D[:, 1]).astype(np.int64)
+    counts = dist // spacing + 1
 
-def draw_overlay(path, landmarks, bcoords):
+    # Segment index and step i (0, spacing, 2·spacing, …) of every dot
+    seg = np.repeat(np.arange(len(A)), counts)
+    i = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)) * spacing
+    t = np.divide(i, dist[seg], out=np.zeros(len(seg)), where=dist[seg] > 0)
+    centers = (A[seg] + D[seg] * t[:, None]).astype(np.int64)   # truncates like int()
+
+    pts = (centers[:, None, :] + DOT_STAMP[None, :, :]).reshape(-1, 2)
+    h, w = img.shape[:2]
+    keep = (pts[:, 0] >= 0) & (pts[:, 0] < w) & (pts[:, 1] >= 0) & (pts[:, 1] < h)
+    pts = pts[keep]
+    img[pts[:, 1], pts[:, 0]] = color
+
+
+# Decoded once; every overlay is drawn on a copy.
+@lru_cache(maxsize=1)
+def base_map():
     img = cv2.imread(INPUT_MAP)
-    for a, b in zip(path, path[1:]):
-        _dotted_line(img, a, b)
+    img.flags.writeable = False
+    return img
+
+def draw_overlay(path, landmarks, bcoords, out=OVERLAY_OUT):
+    img = base_map().copy()
+    _dotted_path(img, path)
     for nm, _ in landmarks:
         x, y = map(int, bcoords[nm])
         cv2.circle(img, (x, y), 10, (0, 255, 0), -1)
         cv2.putText(img, nm, (x + 5, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.imwrite(OVERLAY_OUT, img)
+    cv2.imwrite(out, img)
 
+# Pure function of the building pair, so repeat routes skip the graph search.
+# Callers must treat the returned lists as read-only.
+@lru_cache(maxsize=512)
 def compute_route(start, end):
     if not start or not end:
         raise ValueError("Start or end building not specified.")
-    G, b2n, bcoords = load_data()
-    factor = calibrate_factor()
-    path = find_route(G, b2n, start, end)
-    landmarks = extract_landmarks(path, bcoords)
-    pix_lines, ft_lines = make_instructions(landmarks, bcoords, factor)
+    b2n, bcoords = load_data()
+    path = find_route(b2n, start, end)
+    landmarks = extract_landmarks(path)
+    pix_lines, ft_lines = make_instructions(landmarks, bcoords, FACTOR)
     return pix_lines, ft_lines, path, landmarks
 
 # ─── CLI Mode ─────────────────────────────────────────────────────────────
@@ -132,7 +279,7 @@ if __name__ == "__main__":
         save_node_list(path)
         with open(INSTR_PIX_OUT, "w") as f: f.write("\n".join(pix_lines))
         with open(INSTR_FEET_OUT, "w") as f: f.write("\n".join(ft_lines))
-        draw_overlay(path, landmarks, json.load(open(BUILDING_COORDS)))
+        draw_overlay(path, landmarks, load_data()[1])
     except Exception as ex:
         print(f"[❌] Error: {ex}")
         sys.exit(1)
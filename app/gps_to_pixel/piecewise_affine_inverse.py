@@ -7,16 +7,33 @@ Instead, gps_to_pixel(lat,lon) simply loops over every triangle, checks barycent
 and returns the exact inverse if found.
 
 Dependencies:
-    numpy, scipy, pickle, json
+    numpy, scipy, pickle, orjson
+    numba (optional: JIT-compiles the inverse triangle search)
 """
 
-import json
+import orjson
 import pickle
 import os
 
 import numpy as np
 from scipy.spatial import Delaunay
 
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    # No numba: the decorated functions simply run as plain Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+# Points per pass in the all-triangles test, which builds (N,T,3) temporaries:
+# chunking keeps that at about LOCATE_CHUNK*T*3 floats however big N is
+LOCATE_CHUNK = 256
+
 
 def load_calibration(cal_file):
     """
@@ -26,18 +43,16 @@ def load_calibration(cal_file):
         pixel_pts: np.ndarray shape (N,2)  = [[x1,y1], [x2,y2], …]
         gps_pts:   np.ndarray shape (N,2)  = [[lat1,lon1], [lat2,lon2], …]
     """
-    with open(cal_file, "r") as f:
-        data = json.load(f)
+    with open(cal_file, "rb") as f:
+        data = orjson.loads(f.read())
 
-    pix_list = []
-    gps_list = []
-    for e in data:
+    pixel_pts = np.empty((len(data), 2), dtype=float)
+    gps_pts   = np.empty((len(data), 2), dtype=float)
+    for i, e in enumerate(data):
         if "x" not in e or "y" not in e or "lat" not in e or "lon" not in e:
             raise KeyError(f"Calibration entry missing keys: {e}")
-        pix_list.append([float(e["x"]), float(e["y"])])
-        gps_list.append([float(e["lat"]), float(e["lon"])])
-    pixel_pts = np.array(pix_list, dtype=float)
-    gps_pts   = np.array(gps_list, dtype=float)
+        pixel_pts[i] = float(e["x"]), float(e["y"])
+        gps_pts[i]   = float(e["lat"]), float(e["lon"])
     return pixel_pts, gps_pts
 
 
@@ -48,34 +63,50 @@ def build_forward_affines(pixel_pts, gps_pts):
 
     Returns:
         delaunay_pixel: scipy.spatial.Delaunay
-        affines:       list of length T, each is dict { 'verts': (i0,i1,i2), 'A':2×2, 'b':2 }
+        A_all:         np.ndarray shape (T,2,2), the A_i stacked
+        b_all:         np.ndarray shape (T,2),   the b_i stacked
         triangles:     np.ndarray shape (T,3) = delaunay_pixel.simplices
     """
     delaunay_pixel = Delaunay(pixel_pts)
     triangles = delaunay_pixel.simplices   # shape (T,3)
 
-    affines = []
-    for simplex in triangles:
-        P = pixel_pts[simplex]  # shape (3,2)
-        G = gps_pts[simplex]    # shape (3,2)
+    # Per triangle:  X @ Mᵀ = Y,  where X is 3×3 = [[x0,y0,1],[x1,y1,1],[x2,y2,1]]
+    #                                    Y is 3×2 = [[lat0,lon0],[lat1,lon1],[lat2,lon2]]
+    # solved for all T triangles with one batched LU solve.
+    T = triangles.shape[0]
+    X_all = np.empty((T, 3, 3), dtype=float)
+    X_all[:, :, :2] = pixel_pts[triangles]
+    X_all[:, :, 2] = 1.0
+    Y_all = gps_pts[triangles]                                            # (T,3,2)
+    M_all = np.linalg.solve(X_all, Y_all).transpose(0, 2, 1)             # (T,2,3)
 
-        # Build X and Y:
-        #   X @ Mᵀ = Y,  where X is 3×3 = [[x0,y0,1],[x1,y1,1],[x2,y2,1]]
-        #         Y is 3×2 = [[lat0,lon0],[lat1,lon1],[lat2,lon2]]
-        X = np.vstack([
-            [P[0, 0], P[0, 1], 1.0],
-            [P[1, 0], P[1, 1], 1.0],
-            [P[2, 0], P[2, 1], 1.0],
-        ])  # (3×3)
-        Y = G  # (3×2)
+    A_all = np.ascontiguousarray(M_all[:, :, :2])
+    b_all = np.ascontiguousarray(M_all[:, :, 2])
+    return delaunay_pixel, A_all, b_all, triangles.copy()
 
-        X_inv = np.linalg.inv(X)       # (3×3)
-        M = (X_inv @ Y).T              # (2×3)
-        A = M[:, :2]                   # (2×2)
-        b = M[:, 2]                    # (2,)
-        affines.append({"verts": simplex.copy(), "A": A.copy(), "b": b.copy()})
 
-    return delaunay_pixel, affines, triangles.copy()
+@njit(cache=True)
+def _locate_and_bary(lat, lon, G0_all, Minv_all, bboxes, P_all):
+    """
+    Scalar gps_to_pixel kernel over the mapper's precomputed arrays: bbox
+    prune, barycentric solve with the per-triangle inverse, inside test and
+    pixel blend, in one loop over the triangles in order.
+    Returns (found, x, y).
+    """
+    for t in range(G0_all.shape[0]):
+        if not (bboxes[t, 0] <= lat <= bboxes[t, 1] and bboxes[t, 2] <= lon <= bboxes[t, 3]):
+            continue
+        d0 = lat - G0_all[t, 0]
+        d1 = lon - G0_all[t, 1]
+        beta = Minv_all[t, 0, 0] * d0 + Minv_all[t, 0, 1] * d1
+        gamma = Minv_all[t, 1, 0] * d0 + Minv_all[t, 1, 1] * d1
+        alpha = 1.0 - beta - gamma
+        # Written so NaN (degenerate triangle) fails the test
+        if alpha >= -1e-9 and beta >= -1e-9 and gamma >= -1e-9:
+            x = alpha * P_all[t, 0, 0] + beta * P_all[t, 1, 0] + gamma * P_all[t, 2, 0]
+            y = alpha * P_all[t, 0, 1] + beta * P_all[t, 1, 1] + gamma * P_all[t, 2, 1]
+            return True, x, y
+    return False, 0.0, 0.0
 
 
 class PiecewiseAffineMapper:
@@ -88,34 +119,88 @@ class PiecewiseAffineMapper:
       self.pixel_pts
       self.gps_pts
       self.delaunay_pixel
-      self.affines          (list of per-triangle dicts)
+      self.A_all, self.b_all  (T×2×2 and T×2 per-triangle forward affines)
       self.triangles        (T×3 array of indices)
       self._gps_bboxes      (T×4 array of [min_lat, max_lat, min_lon, max_lon]), for quick pruning
+
+    plus arrays derived from those on construction/unpickling (not saved):
+      self._G0              (T×2 first GPS vertex of each triangle)
+      self._Mgps_inv        (T×2×2 inverse GPS edge matrices; NaN for degenerate triangles)
+      self._P               (T×3×2 pixel vertices of each triangle)
+      self._delaunay_gps    (Delaunay of gps_pts for O(log T) point location, or None
+                             if its triangles differ from the pixel-space ones)
+      self._gps_tf, self._gps_px  (its transforms and pixel corners as nested lists,
+                             for the allocation-free scalar path)
     """
 
+    _DERIVED = ("_G0", "_Mgps_inv", "_P", "_delaunay_gps", "_gps_tf", "_gps_px")
+
     def __init__(self, pixel_pts: np.ndarray, gps_pts: np.ndarray):
         self.pixel_pts = pixel_pts.copy()
         self.gps_pts   = gps_pts.copy()
 
         # 1) Build forward Delaunay + per-triangle affines
-        self.delaunay_pixel, self.affines, self.triangles = build_forward_affines(self.pixel_pts, self.gps_pts)
+        self.delaunay_pixel, self.A_all, self.b_all, self.triangles = build_forward_affines(self.pixel_pts, self.gps_pts)
 
         # 2) For gps_to_pixel, precompute each triangle’s GPS‐bounding box:
         #    so that we can quickly skip triangles whose bounding box does NOT contain (lat,lon).
-        T = self.triangles.shape[0]
-        self._gps_bboxes = np.zeros((T, 4), dtype=float)
-        # Columns will be: [min_lat, max_lat, min_lon, max_lon]
-        for i in range(T):
-            (i0, i1, i2) = self.triangles[i]
-            G0 = self.gps_pts[i0]
-            G1 = self.gps_pts[i1]
-            G2 = self.gps_pts[i2]
-            lats = np.array([G0[0], G1[0], G2[0]])
-            lons = np.array([G0[1], G1[1], G2[1]])
-            self._gps_bboxes[i, 0] = lats.min()
-            self._gps_bboxes[i, 1] = lats.max()
-            self._gps_bboxes[i, 2] = lons.min()
-            self._gps_bboxes[i, 3] = lons.max()
+        tri_gps = self.gps_pts[self.triangles]   # (T,3,2)
+        # Columns are: [min_lat, max_lat, min_lon, max_lon]
+        self._gps_bboxes = np.stack([
+            tri_gps[:, :, 0].min(axis=1),
+            tri_gps[:, :, 0].max(axis=1),
+            tri_gps[:, :, 1].min(axis=1),
+            tri_gps[:, :, 1].max(axis=1),
+        ], axis=1)
+
+        self._precompute_inverse()
+
+    def _precompute_inverse(self):
+        """Per-triangle arrays for solving barycentric coords of many triangles at once."""
+        tris = self.triangles
+        G0 = self.gps_pts[tris[:, 0]]
+        # Columns [G1–G0 , G2–G0] of each triangle's 2×2 GPS edge matrix
+        M = np.stack([self.gps_pts[tris[:, 1]] - G0, self.gps_pts[tris[:, 2]] - G0], axis=2)
+        det = M[:, 0, 0] * M[:, 1, 1] - M[:, 0, 1] * M[:, 1, 0]
+        usable = np.abs(det) >= 1e-12
+        M_inv = np.full_like(M, np.nan)
+        M_inv[usable] = np.linalg.inv(M[usable])
+
+        self._G0 = G0
+        self._Mgps_inv = M_inv
+        self._P = self.pixel_pts[tris]
+
+        # Point location by Delaunay is only exact if triangulating the GPS
+        # points yields the same triangles as the pixel-space triangulation.
+        try:
+            delaunay_gps = Delaunay(self.gps_pts)
+        except Exception:
+            delaunay_gps = None
+        if delaunay_gps is not None and (
+            {frozenset(t) for t in delaunay_gps.simplices.tolist()}
+            == {frozenset(t) for t in tris.tolist()}
+        ):
+            self._delaunay_gps = delaunay_gps
+            self._gps_tf = delaunay_gps.transform.tolist()
+            self._gps_px = self.pixel_pts[delaunay_gps.simplices].tolist()
+        else:
+            self._delaunay_gps = None
+            self._gps_tf = self._gps_px = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._DERIVED:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "affines" in state:
+            # Pickled before the affines were stored as stacked arrays
+            affines = self.__dict__.pop("affines")
+            self.A_all = np.stack([a["A"] for a in affines])
+            self.b_all = np.stack([a["b"] for a in affines])
+        self._precompute_inverse()
 
     def pixel_to_gps(self, x: float, y: float):
         """
@@ -124,72 +209,113 @@ class PiecewiseAffineMapper:
         tri_idx = int(self.delaunay_pixel.find_simplex([[x, y]])[0])
         if tri_idx < 0:
             return None
-        A = self.affines[tri_idx]["A"]   # (2×2)
-        b = self.affines[tri_idx]["b"]   # (2,)
+        A = self.A_all[tri_idx]   # (2×2)
+        b = self.b_all[tri_idx]   # (2,)
         latlon = A.dot(np.array([x, y], dtype=float)) + b  # (2,)
         return float(latlon[0]), float(latlon[1])
 
+    def pixel_to_gps_many(self, coords):
+        """
+        Vectorized pixel_to_gps() for an (N,2) array of (x,y) rows.
+        Returns an (N,2) float array of (lat,lon), NaN rows outside the hull.
+        """
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        simplex = self.delaunay_pixel.find_simplex(coords)
+        latlon = np.einsum("nij,nj->ni", self.A_all[simplex], coords) + self.b_all[simplex]
+        latlon[simplex < 0] = np.nan
+        return latlon
+
     def gps_to_pixel(self, lat: float, lon: float):
         """
         True inverse: (lat,lon) → (x,y) exactly.  
-        We loop over every triangle, do a quick bounding-box check, then compute barycentric.
+        With numba installed this runs a JIT-compiled loop over every triangle
+        (bbox check, then barycentric). Otherwise it uses find_simplex on the
+        GPS-space Delaunay when its triangles match the pixel-space ones, or
+        a vectorized pass over all triangles.
         Returns None if (lat,lon) is outside the convex hull of all GPS-calibration points.
         """
-        # 1) Quick bounding-box prune: find all triangles whose [min_lat, max_lat]×[min_lon,max_lon]
-        #    contains (lat, lon).  Only those can possibly contain the point. 
-        #    This cuts down the number of barycentric tests.
-        #    If T is small (<500), you can skip this bounding-box step and just loop directly.
-        candidates = []
-        bboxes = self._gps_bboxes
-        # We can vectorize the bbox check for speed:
-        mask_lat = (bboxes[:, 0] <= lat) & (lat <= bboxes[:, 1])
-        mask_lon = (bboxes[:, 2] <= lon) & (lon <= bboxes[:, 3])
-        bbox_hits = np.where(mask_lat & mask_lon)[0]
-        if bbox_hits.size == 0:
-            # No triangle even has (lat,lon) in its axis‐aligned bbox
-            return None
-
-        # 2) For each candidate triangle, compute barycentric coords in GPS‐space:
-        for tri_idx in bbox_hits:
-            i0, i1, i2 = self.triangles[tri_idx]
-            G0 = self.gps_pts[i0]  # (lat0, lon0)
-            G1 = self.gps_pts[i1]
-            G2 = self.gps_pts[i2]
-
-            # Build 2×2 matrix [G1–G0 , G2–G0] and Δ = [lat–lat0, lon–lon0]
-            Mgps = np.array([
-                [G1[0] - G0[0],  G2[0] - G0[0]],
-                [G1[1] - G0[1],  G2[1] - G0[1]]
-            ], dtype=float)
-            Δ = np.array([lat - G0[0], lon - G0[1]], dtype=float)
-
-            # Solve [β; γ] = Mgps^{-1} × Δ
-            # If Mgps is singular (zero‐area GPS‐triangle), skip
-            det = Mgps[0, 0] * Mgps[1, 1] - Mgps[0, 1] * Mgps[1, 0]
-            if abs(det) < 1e-12:
-                # Degenerate (collinear) or extremely skinny triangle in GPS‐space
-                continue
-
-            invM = np.linalg.inv(Mgps)  # (2×2)
-            beta_gamma = invM.dot(Δ)    # shape (2,)
-            β, γ = float(beta_gamma[0]), float(beta_gamma[1])
-            α = 1.0 - β - γ
-
-            # Check if inside (allow a small negative tolerance for numerical noise)
-            if α < -1e-9 or β < -1e-9 or γ < -1e-9:
-                continue
-
-            # 3) If we reach here, (lat,lon) is inside GPS‐triangle `tri_idx`.  Recover pixel by barycentric:
-            P0 = self.pixel_pts[i0]
-            P1 = self.pixel_pts[i1]
-            P2 = self.pixel_pts[i2]
-
-            x = α * P0[0] + β * P1[0] + γ * P2[0]
-            y = α * P0[1] + β * P1[1] + γ * P2[1]
-            return float(x), float(y)
-
-        # If no candidate triangle actually contained (lat,lon), then it's outside the hull:
-        return None
+        if HAVE_NUMBA:
+            found, x, y = _locate_and_bary(
+                float(lat), float(lon), self._G0, self._Mgps_inv, self._gps_bboxes, self._P
+            )
+            return (x, y) if found else None
+
+        if self._delaunay_gps is not None:
+            tri_idx = int(self._delaunay_gps.find_simplex((lat, lon)))
+            if tri_idx < 0:
+                return None
+            # Barycentric coords and the pixel blend in plain floats: no
+            # per-call arrays on this hot path
+            (t00, t01), (t10, t11), (r0, r1) = self._gps_tf[tri_idx]
+            dlat, dlon = lat - r0, lon - r1
+            b0 = t00 * dlat + t01 * dlon
+            b1 = t10 * dlat + t11 * dlon
+            b2 = 1.0 - b0 - b1
+            (x0, y0), (x1, y1), (x2, y2) = self._gps_px[tri_idx]
+            return (float(b0 * x0 + b1 * x1 + b2 * x2),
+                    float(b0 * y0 + b1 * y1 + b2 * y2))
+
+        x, y = self.gps_to_pixel_many([[lat, lon]])[0]
+        return None if np.isnan(x) else (float(x), float(y))
+
+    def gps_to_pixel_many(self, pts):
+        """
+        Vectorized gps_to_pixel() for an (N,2) array of (lat,lon) rows.
+        Tests LOCATE_CHUNK points at a time against every triangle and returns
+        an (N,2) float array of (x,y), with NaN rows for points outside the hull.
+        """
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        if self._delaunay_gps is not None:
+            return self._locate_delaunay(pts)
+        if len(pts) > LOCATE_CHUNK:
+            return np.concatenate([
+                self._locate_all(pts[i:i + LOCATE_CHUNK])
+                for i in range(0, len(pts), LOCATE_CHUNK)
+            ])
+        return self._locate_all(pts)
+
+    def _locate_all(self, pts):
+        """
+        (N,2) lat/lon → (N,2) pixels by testing every point against every
+        triangle at once. NaN rows for points outside the hull.
+        """
+        # Barycentric coords of every point in every triangle: (N,T,3) = [α, β, γ]
+        D = pts[:, None, :] - self._G0[None, :, :]
+        bg = np.einsum("tij,ntj->nti", self._Mgps_inv, D)
+        W = np.concatenate([1.0 - bg.sum(axis=2, keepdims=True), bg], axis=2)
+
+        lat, lon = pts[:, :1], pts[:, 1:]
+        bb = self._gps_bboxes
+        inside = (
+            (bb[:, 0] <= lat) & (lat <= bb[:, 1])
+            & (bb[:, 2] <= lon) & (lon <= bb[:, 3])
+            & (W >= -1e-9).all(axis=2)      # NaN (degenerate triangle) fails here
+        )
+
+        # First containing triangle per point, same as the scalar search
+        tri_idx = inside.argmax(axis=1)
+        rows = np.arange(len(pts))
+        xy = np.einsum("nk,nkd->nd", W[rows, tri_idx], self._P[tri_idx])
+        xy[~inside.any(axis=1)] = np.nan
+        return xy
+
+    def _locate_delaunay(self, pts):
+        """
+        (N,2) lat/lon → (N,2) pixels via find_simplex on the GPS Delaunay and
+        its affine `transform` (the documented barycentric recipe).
+        NaN rows for points outside the hull.
+        """
+        tri = self._delaunay_gps
+        idx = tri.find_simplex(pts)
+        ok = idx >= 0
+        xy = np.full((len(pts), 2), np.nan)
+        if ok.any():
+            T = tri.transform[idx[ok]]                                  # (n,3,2)
+            b = np.einsum("nij,nj->ni", T[:, :2], pts[ok] - T[:, 2])    # (n,2)
+            W = np.concatenate([b, 1.0 - b.sum(axis=1, keepdims=True)], axis=1)
+            corners = self.pixel_pts[tri.simplices[idx[ok]]]            # (n,3,2)
+            xy[ok] = np.einsum("nk,nkd->nd", W, corners)
+        return xy
 
     def save(self, filename: str):
         """
@@ -197,7 +323,7 @@ class PiecewiseAffineMapper:
         That includes:
           - pixel_pts, gps_pts
           - delaunay_pixel
-          - affines (list of per-triangle dicts)
+          - A_all, b_all (stacked per-triangle affines)
           - triangles (T×3)
           - _gps_bboxes (T×4)
         """
@@ -209,12 +335,24 @@ class PiecewiseAffineMapper:
         """
         Load a previously saved mapper from disk:
             mapper = PiecewiseAffineMapper.load("mapper.pkl")
+
+        mapper.pkl is written by running this file as a script, so the class is
+        recorded as __main__.PiecewiseAffineMapper.  Resolve that name to this
+        class so the pickle also loads when __main__ is something else
+        (e.g. a WSGI server).
         """
         with open(filename, "rb") as f:
-            obj = pickle.load(f)
+            obj = _MapperUnpickler(f).load()
         return obj
 
 
+class _MapperUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if name == PiecewiseAffineMapper.__name__:
+            return PiecewiseAffineMapper
+        return super().find_class(module, name)
+
+
 if __name__ == "__main__":
     # Example usage:
 
@@ -9,6 +9,7 @@ Requirements:
     - Python 3.7+
     - numpy
     - scipy
+    - numba (optional: parallel kernel for batch_pixel_to_gps)
 
 Usage:
     Place your calibration JSON file (`gps_calibration.json`) in the same directory as this script.
@@ -23,12 +24,79 @@ This will:
     4. Define a function `pixel_to_gps(x, y)` that finds the containing triangle and applies
        the corresponding affine transform.
     5. (Optional) Build a KDTree for inverse lookups (lat, lon) → nearest calibration pixel.
+
+The triangulation (simplices and barycentric transforms), the affines and any triangle
+LUT are cached under `cache/`, keyed by a hash of the calibration points, so later runs
+locate points from the cached arrays and never run qhull.
 """
 
-import json
+import hashlib
 import os
+import tempfile
+import zipfile
+import orjson
 import numpy as np
-from scipy.spatial import Delaunay, KDTree
+from scipy.spatial import Delaunay, cKDTree as KDTree
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+# What a truncated or otherwise unreadable cache file raises from np.load
+CACHE_READ_ERRORS = (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile)
+
+
+def save_cache_file(path, write):
+    """
+    Call write(f) on a temporary file next to `path`, then rename it into place,
+    so readers (other workers, a later run after a crash) never see a partial file.
+    """
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".tmp-", suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+if HAVE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _apply_affines(xy, idx, packed, origin, out):
+        """out[i] = origin + packed affine of triangle idx[i] applied to xy[i], or NaN where idx[i] < 0."""
+        for i in prange(xy.shape[0]):
+            t = idx[i]
+            if t < 0:
+                out[i, 0] = np.nan
+                out[i, 1] = np.nan
+                continue
+            x = xy[i, 0]
+            y = xy[i, 1]
+            p = packed[t]
+            out[i, 0] = origin[0] + (p[0] * x + p[1] * y + p[2])
+            out[i, 1] = origin[1] + (p[3] * x + p[4] * y + p[5])
+
+
+def pack_affines(A_all: np.ndarray, b_all: np.ndarray, origin: np.ndarray):
+    """
+    Pack the stacked affines into one contiguous (T, 6) float32 array, one row per
+    triangle: [a00, a01, b0, a10, a11, b1]. The translations are stored relative to
+    `origin` (a reference lat/lon) so float32 keeps millimetre precision; add
+    origin back after applying a row.
+    """
+    packed = np.empty((len(A_all), 6), dtype=np.float32)
+    packed[:, 0:2] = A_all[:, 0, :]
+    packed[:, 2] = b_all[:, 0] - origin[0]
+    packed[:, 3:5] = A_all[:, 1, :]
+    packed[:, 5] = b_all[:, 1] - origin[1]
+    return packed
 
 
 def load_calibration(cal_file: str):
@@ -40,21 +108,21 @@ def load_calibration(cal_file: str):
         pixel_coords: (N, 2) numpy array of pixel (x, y)
         gps_coords:   (N, 2) numpy array of (lat, lon)
     """
-    with open(cal_file, 'r') as f:
-        data = json.load(f)
+    with open(cal_file, 'rb') as f:
+        data = orjson.loads(f.read())
 
-    pixel_list = []
-    gps_list = []
+    # Filled in place rather than built as lists of pairs and vstacked
+    N = len(data)
+    pixel_coords = np.empty((N, 2))  # shape (N, 2)
+    gps_coords = np.empty((N, 2))    # shape (N, 2)
 
-    for entry in data:
-        if all(k in entry for k in ("x", "y", "lat", "lon")):
-            pixel_list.append([entry["x"], entry["y"]])
-            gps_list.append([entry["lat"], entry["lon"]])
-        else:
+    for i, entry in enumerate(data):
+        if not all(k in entry for k in ("x", "y", "lat", "lon")):
             raise ValueError(f"Missing keys in calibration entry: {entry}")
-
-    pixel_coords = np.vstack(pixel_list)  # shape (N, 2)
-    gps_coords = np.vstack(gps_list)      # shape (N, 2)
+        pixel_coords[i, 0] = entry["x"]
+        pixel_coords[i, 1] = entry["y"]
+        gps_coords[i, 0] = entry["lat"]
+        gps_coords[i, 1] = entry["lon"]
 
     return pixel_coords, gps_coords
 
@@ -67,85 +135,71 @@ def compute_triangle_affines(pixel_coords: np.ndarray, gps_coords: np.ndarray, d
     The transform for triangle i is:
         [lat; lon] = A_i @ [x; y] + b_i
 
-    We solve for A_i (2×2) and b_i (2×1) exactly, given three corner correspondences.
+    We solve for A_i (2×2) and b_i (2×1) exactly, given three corner correspondences,
+    for all T triangles in one batched linear solve.
 
     Returns:
-        affines: list of dicts of length T (# of triangles). Each dict has:
-            'vertices': indices of the 3 calibration points (into pixel_coords/gps_coords)
-            'A': (2×2) numpy array
-            'b': (2,) numpy array
+        A_all: (T, 2, 2) numpy array, A_i stacked
+        b_all: (T, 2) numpy array, b_i stacked
     """
-    affines = []
-
-    for simplex in delaunay.simplices:
-        # simplex is a length-3 array of indices into pixel_coords / gps_coords
-        pts_pix = pixel_coords[simplex]   # shape (3, 2)
-        pts_gps = gps_coords[simplex]     # shape (3, 2)
-
-        # We want: [x_i, y_i, 1] @ [a11 a12; a21 a22; tx ty]^T = [lat_i, lon_i]
-        # Or equivalently: [ [x1, y1, 1],
-        #                    [x2, y2, 1],
-        #                    [x3, y3, 1] ] @ M^T = [ [lat1, lon1],
-        #                                            [lat2, lon2],
-        #                                            [lat3, lon3] ]
-        #
-        # Let X = [[x1, y1, 1],
-        #          [x2, y2, 1],
-        #          [x3, y3, 1]]  (3×3)
-        # Let Y = [[lat1, lon1],
-        #          [lat2, lon2],
-        #          [lat3, lon3]]  (3×2)
-        #
-        # Solve for M: (3×3) M^T = Y  →  M^T = X^-1 @ Y  → M = (Y^T @ (X^-T))
-        #
-        # Then M has shape (2, 3). We can decompose:
-        #    A_i = M[:, :2]   (2×2)
-        #    b_i = M[:, 2]    (2,)
-
-        X = np.vstack([
-            np.hstack([pts_pix[0], 1.0]),
-            np.hstack([pts_pix[1], 1.0]),
-            np.hstack([pts_pix[2], 1.0])
-        ])  # (3, 3)
-
-        Y = pts_gps  # (3, 2)
-
-        # Solve M^T = X^{-1} @ Y  →  M = (X^{-T} @ Y.T).T
-        try:
-            X_inv = np.linalg.inv(X)       # (3, 3)
-        except np.linalg.LinAlgError:
-            # Degenerate triangle (collinear points), skip or handle
-            raise RuntimeError(f"Degenerate triangle with points: {pts_pix}")
-
-        M_full = (X_inv @ Y)            # (3, 2). But that's actually X_inv.T @ Y.T? Let's check:
-        # Actually, (X @ M.T = Y) → M.T = X^{-1} @ Y → M = (Y.T @ X^{-T}).T.
-        # But if we do M_full = X_inv @ Y, we get shape (3,2): each row i is coefficients mapping to lat/lon?
-        # Let's verify by testing: X (3×3) times M_full (3×2) = (3×2) equals Y? Yes:
-        #   X (3×3) @ (3×2) = (3×2) → equals Y. So M_full = 3×2. We can transpose to get M: (2×3).
-        M = M_full.T   # shape (2, 3)
-
-        # Decompose:
-        A = M[:, :2]   # (2, 2)
-        b = M[:, 2]    # (2,)
-
-        affines.append({
-            "vertices": simplex.copy(),
-            "A": A,
-            "b": b
-        })
-
-    return affines
-
-
-def build_affine_lookup(pixel_coords: np.ndarray, gps_coords: np.ndarray):
+    simplices = delaunay.simplices
+    T = simplices.shape[0]
+
+    # Per triangle:  X @ M^T = Y  with
+    #   X = [[x1, y1, 1],          Y = [[lat1, lon1],
+    #        [x2, y2, 1],               [lat2, lon2],
+    #        [x3, y3, 1]]  (3×3)        [lat3, lon3]]  (3×2)
+    # so M^T = solve(X, Y), and M (2×3) = [A_i | b_i].
+    pts_pix = pixel_coords[simplices].astype(float)                       # (T, 3, 2)
+    X = np.concatenate([pts_pix, np.ones((T, 3, 1))], axis=2)             # (T, 3, 3)
+    Y = gps_coords[simplices].astype(float)                               # (T, 3, 2)
+    try:
+        M_T = np.linalg.solve(X, Y)                                       # (T, 3, 2)
+    except np.linalg.LinAlgError:
+        # Some triangle is degenerate (collinear points)
+        raise RuntimeError("Degenerate triangle in the calibration triangulation")
+
+    M = M_T.transpose(0, 2, 1)                                            # (T, 2, 3)
+    A_all = M[:, :, :2].copy()
+    b_all = M[:, :, 2].copy()
+    return A_all, b_all
+
+
+def calibration_key(pixel_coords: np.ndarray, gps_coords: np.ndarray) -> str:
+    """Short content hash of the calibration points, used to name cache files."""
+    h = hashlib.blake2b(np.ascontiguousarray(pixel_coords, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(gps_coords, dtype=float).tobytes())
+    return h.hexdigest()[:16]
+
+
+def build_affine_lookup(pixel_coords: np.ndarray, gps_coords: np.ndarray, cache_dir=CACHE_DIR):
     """
     Build the Delaunay triangulation, compute per-triangle affine maps, and return:
-        - delaunay: the Delaunay object on pixel_coords
-        - affines: list of dicts with keys 'vertices', 'A', 'b'
+        - delaunay: the Delaunay object on pixel_coords (None if loaded from cache)
+        - simplices: (T, 3) vertex indices of each triangle
+        - transform: (T, 3, 2) barycentric transforms (Delaunay.transform)
+        - A_all, b_all: stacked per-triangle affines, (T, 2, 2) and (T, 2)
+    With a cache_dir, the result is stored in `{key}.npz` and reloaded on later
+    calls with the same calibration points; pass cache_dir=None to disable.
+    The cached arrays are enough to locate points, so qhull does not run at all.
     """
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, calibration_key(pixel_coords, gps_coords) + ".npz")
+        if os.path.exists(path):
+            try:
+                with np.load(path) as z:
+                    if "transform" in z.files:   # older caches lack it; rebuild those
+                        return None, z["simplices"], z["transform"], z["A_all"], z["b_all"]
+            except CACHE_READ_ERRORS:
+                pass   # unreadable cache: rebuild and overwrite it
+
     delaunay = Delaunay(pixel_coords)
-    affines = compute_triangle_affines(pixel_coords, gps_coords, delaunay)
-    return delaunay, affines
+    A_all, b_all = compute_triangle_affines(pixel_coords, gps_coords, delaunay)
+    if path:
+        save_cache_file(path, lambda f: np.savez_compressed(
+            f, simplices=delaunay.simplices, transform=delaunay.transform, A_all=A_all, b_all=b_all))
+    return delaunay, delaunay.simplices, delaunay.transform, A_all, b_all
 
 
 class PixelToGPSMapper:
@@ -153,13 +207,98 @@ class PixelToGPSMapper:
     Encapsulates the Delaunay-based piecewise-affine mapping from pixel → (lat, lon).
     """
 
-    def __init__(self, pixel_coords: np.ndarray, gps_coords: np.ndarray):
+    # Barycentric slack for points on triangle edges, and the (points × triangles)
+    # budget per chunk of the cached-transform search
+    BARY_EPS = 1e-10
+    LOCATE_CHUNK = 1 << 20
+
+    def __init__(self, pixel_coords: np.ndarray, gps_coords: np.ndarray, cache_dir=CACHE_DIR):
         """
-        Initialize by building triangulation and computing affines.
+        Initialize by building triangulation and computing affines
+        (or loading both from cache_dir).
         """
         self.pixel_coords = pixel_coords
         self.gps_coords = gps_coords
-        self.delaunay, self.affines = build_affine_lookup(pixel_coords, gps_coords)
+        self.cache_dir = cache_dir
+        self.delaunay, self.simplices, self.transform, self.A_all, self.b_all = build_affine_lookup(
+            pixel_coords, gps_coords, cache_dir
+        )
+        self.tri_lut = None
+        self.gps_origin = gps_coords.mean(axis=0)
+        self.affine_packed = pack_affines(self.A_all, self.b_all, self.gps_origin)
+        # Bounding box of the convex hull: anything outside maps to None without a lookup
+        (self.xmin, self.ymin), (self.xmax, self.ymax) = pixel_coords.min(axis=0), pixel_coords.max(axis=0)
+
+    def find_simplex(self, xy: np.ndarray):
+        """
+        Triangle index containing each of the (N×2) points, or -1 outside.
+        Uses the qhull walk when the triangulation was built this run, otherwise
+        a barycentric test against every cached transform (T is small).
+        """
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        if self.delaunay is not None:
+            return self.delaunay.find_simplex(xy)
+        T = len(self.transform)
+        out = np.full(len(xy), -1, dtype=np.intp)
+        Tinv, r = self.transform[:, :2], self.transform[:, 2]
+        step = max(1, self.LOCATE_CHUNK // max(T, 1))
+        for i0 in range(0, len(xy), step):
+            p = xy[i0:i0 + step]
+            bary = np.einsum("tij,ntj->nti", Tinv, p[:, None, :] - r[None])     # (n, T, 2)
+            inside = (bary >= -self.BARY_EPS).all(axis=2) & (bary.sum(axis=2) <= 1 + self.BARY_EPS)
+            hit = inside.any(axis=1)
+            out[i0:i0 + len(p)][hit] = inside[hit].argmax(axis=1)
+        return out
+
+    def build_triangle_lut(self, width: int, height: int, rows_per_chunk: int = 256):
+        """
+        (Optional) Rasterize the triangulation over a width×height image once:
+        tri_lut[y, x] is the simplex containing integer pixel (x, y), or -1.
+        pixel_to_gps() takes its candidate triangle from this table and only
+        calls find_simplex when the point is not inside it. With a live
+        Delaunay, rows are located in chunks to bound the temporary memory;
+        from cache, each triangle fills its own bounding box. The table is
+        cached next to the affines and memory-mapped on later runs.
+        """
+        path = None
+        if self.cache_dir:
+            key = calibration_key(self.pixel_coords, self.gps_coords)
+            path = os.path.join(self.cache_dir, f"{key}_lut_{width}x{height}.npy")
+            if os.path.exists(path):
+                try:
+                    lut = np.load(path, mmap_mode="r")
+                except CACHE_READ_ERRORS:
+                    lut = None   # unreadable cache: rebuild and overwrite it
+                if lut is not None and lut.shape == (height, width):
+                    self.tri_lut = lut
+                    return lut
+
+        dtype = np.int16 if len(self.A_all) < np.iinfo(np.int16).max else np.int32
+        if self.delaunay is not None:
+            lut = np.empty((height, width), dtype=dtype)
+            xs = np.arange(width, dtype=float)
+            for y0 in range(0, height, rows_per_chunk):
+                y1 = min(y0 + rows_per_chunk, height)
+                gx, gy = np.meshgrid(xs, np.arange(y0, y1, dtype=float))
+                lut[y0:y1] = self.delaunay.find_simplex(np.column_stack([gx.ravel(), gy.ravel()])).reshape(y1 - y0, width)
+        else:
+            lut = np.full((height, width), -1, dtype=dtype)
+            corners = self.pixel_coords[self.simplices]                       # (T, 3, 2)
+            lo = np.clip(np.floor(corners.min(axis=1)).astype(int), 0, None)
+            hi = np.minimum(np.ceil(corners.max(axis=1)).astype(int) + 1, (width, height))
+            for t in range(len(corners)):
+                (x0, y0), (x1, y1) = lo[t], hi[t]
+                if x0 >= x1 or y0 >= y1:
+                    continue
+                gx, gy = np.meshgrid(np.arange(x0, x1, dtype=float), np.arange(y0, y1, dtype=float))
+                d = np.stack([gx - self.transform[t, 2, 0], gy - self.transform[t, 2, 1]], axis=-1)
+                bary = d @ self.transform[t, :2].T                            # (h, w, 2)
+                inside = (bary >= -self.BARY_EPS).all(axis=-1) & (bary.sum(axis=-1) <= 1 + self.BARY_EPS)
+                lut[y0:y1, x0:x1][inside] = t
+        if path:
+            save_cache_file(path, lambda f: np.save(f, lut))
+        self.tri_lut = lut
+        return lut
 
     def pixel_to_gps(self, x: float, y: float):
         """
@@ -170,38 +309,56 @@ class PixelToGPSMapper:
         Returns:
             (lat, lon) as a tuple of floats, or None if (x, y) is outside convex hull.
         """
-        simplex_index = self.delaunay.find_simplex(np.array([[x, y]]))  # returns array([index]) or [-1]
-        tri_idx = int(simplex_index[0])
+        if not (self.xmin <= x <= self.xmax and self.ymin <= y <= self.ymax):
+            return None
+        lut = self.tri_lut
+        tri_idx = -1
+        if lut is not None and 0 <= x < lut.shape[1] and 0 <= y < lut.shape[0]:
+            # O(1) candidate from the pixel (x, y) falls in. A non-integer point
+            # can lie in a neighbouring triangle, so confirm with its barycentrics.
+            tri_idx = int(lut[int(y), int(x)])
+            if tri_idx >= 0:
+                Tinv, r = self.transform[tri_idx, :2], self.transform[tri_idx, 2]
+                dx, dy = x - r[0], y - r[1]
+                c0 = Tinv[0, 0] * dx + Tinv[0, 1] * dy
+                c1 = Tinv[1, 0] * dx + Tinv[1, 1] * dy
+                eps = self.BARY_EPS
+                if c0 < -eps or c1 < -eps or 1.0 - c0 - c1 < -eps:
+                    tri_idx = -1
+        if tri_idx == -1:
+            # No LUT, or its candidate does not contain the point (edges, hull border)
+            simplex_index = self.find_simplex(np.array([[x, y]]))  # returns array([index]) or [-1]
+            tri_idx = int(simplex_index[0])
         if tri_idx == -1:
             # outside all triangles
             return None
 
-        # Retrieve affine params for this triangle
-        affine = self.affines[tri_idx]
-        A = affine["A"]   # shape (2, 2)
-        b = affine["b"]   # shape (2,)
-
-        # Compute [lat; lon] = A @ [x; y] + b
-        px = np.array([x, y])       # (2,)
-        latlon = A.dot(px) + b      # (2,)
-        lat, lon = float(latlon[0]), float(latlon[1])
+        # Compute [lat; lon] = A @ [x; y] + b for this triangle, as plain scalars
+        A = self.A_all[tri_idx]   # shape (2, 2)
+        b = self.b_all[tri_idx]   # shape (2,)
+        lat = float(A[0, 0] * x + A[0, 1] * y + b[0])
+        lon = float(A[1, 0] * x + A[1, 1] * y + b[1])
         return lat, lon
 
     def batch_pixel_to_gps(self, xy_array: np.ndarray):
         """
         Map a batch of pixel coordinates (N×2) → (N×2) latlon array. Points outside convex hull get (nan, nan).
         """
+        xy_array = np.asarray(xy_array, dtype=float)
         N = xy_array.shape[0]
         result = np.full((N, 2), np.nan, dtype=float)
 
-        simplex_indices = self.delaunay.find_simplex(xy_array)  # shape (N,)
-        for i in range(N):
-            tri_idx = int(simplex_indices[i])
-            if tri_idx == -1:
-                continue
-            A = self.affines[tri_idx]["A"]
-            b = self.affines[tri_idx]["b"]
-            result[i] = A.dot(xy_array[i]) + b
+        idx = self.find_simplex(xy_array)  # shape (N,)
+        if HAVE_NUMBA:
+            # One fused pass over the packed float32 rows: no gathered copies or temporaries
+            _apply_affines(np.ascontiguousarray(xy_array), idx, self.affine_packed, self.gps_origin, result)
+            return result
+
+        valid = idx >= 0
+        P = self.affine_packed[idx[valid]]   # (n, 6)
+        x, y = xy_array[valid, 0], xy_array[valid, 1]
+        result[valid, 0] = self.gps_origin[0] + (P[:, 0] * x + P[:, 1] * y + P[:, 2])
+        result[valid, 1] = self.gps_origin[1] + (P[:, 3] * x + P[:, 4] * y + P[:, 5])
 
         return result
 
@@ -228,6 +385,17 @@ class PixelToGPSMapper:
         dist, idx = self.inverse_kdtree.query([lat, lon])
         return tuple(self.pixel_coords[idx])  # (x, y) from the calibration set
 
+    def batch_approx_gps_to_pixel(self, latlon_array: np.ndarray):
+        """
+        approx_gps_to_pixel() for an (N×2) array of (lat, lon) in one KD-tree query
+        (threaded across cores). Returns the (N×2) pixels of the nearest calibration points.
+        Requires: build_inverse_kdtree() called beforehand.
+        """
+        if not hasattr(self, "inverse_kdtree"):
+            raise RuntimeError("Call build_inverse_kdtree() first to build KDTree.")
+        dist, idx = self.inverse_kdtree.query(np.asarray(latlon_array, dtype=float), workers=-1)
+        return self.pixel_coords[idx]
+
 
 def main():
     # Path to calibration JSON
@@ -263,9 +431,8 @@ def main():
         (41.7430, -72.6910),   # near Clemens roof region
     ]
     print("\n=== Approximate GPS → Pixel (nearest calibration point) ===")
-    for (lat, lon) in test_gps:
-        px = mapper.approx_gps_to_pixel(lat, lon)
-        print(f"GPS ({lat:.8f}, {lon:.8f}) → approx Pixel {px}")
+    for (lat, lon), px in zip(test_gps, mapper.batch_approx_gps_to_pixel(test_gps)):
+        print(f"GPS ({lat:.8f}, {lon:.8f}) → approx Pixel {tuple(px)}")
 
     # 5. (Optional) Batch mapping example:
     batch_result = mapper.batch_pixel_to_gps(test_pixels)
@@ -3,6 +3,7 @@ HTML = """
 <html>
 <head>
   <title>Campus Navigator</title>
+  <link rel="preload" as="image" href="trinity_map_original.png?v={{ map_version }}">
   <style>
     body {
       font-family: Arial, sans-serif;
@@ -50,17 +51,15 @@ HTML = """
       display: block;
       cursor: grab;
     }
-    #map {
+    /* Panned and zoomed purely with transforms on their own compositor layers */
+    #map, #route-canvas {
       position: absolute;
       top: 0;
       left: 0;
-      transform-origin: top left;
-      transition: transform 0.1s ease;
+      transform-origin: 0 0;
+      will-change: transform;
     }
     #route-canvas {
-      position: absolute;
-      top: 0;
-      left: 0;
       pointer-events: none;
       z-index: 5;
     }
@@ -128,24 +127,18 @@ HTML = """
     <pre>{{raw}}</pre>
   </div>
 
-  {% if polished %}
-    <div class="box">
-      <h2>Polished</h2>
-      <pre>{{polished}}</pre>
-    </div>
-  {% else %}
-    <div class="box">
-      <em>Ollama not available; polish step skipped.</em>
-    </div>
-  {% endif %}
+  <div class="box">
+    <h2>Polished</h2>
+    <pre>{% for chunk in polished %}{{chunk}}{% else %}<em>Ollama not available; polish step skipped.</em>{% endfor %}</pre>
+  </div>
 
   <div class="box">
-    <a href="/route_overlay.png" target="_blank">View Overlay Map 📍</a>
+    <a href="/overlays/{{overlay}}" target="_blank">View Overlay Map 📍</a>
   </div>
 {% endif %}
 
 <div id="map-wrapper">
-  <img id="map" src="trinity_map_original.png">
+  <img id="map" src="trinity_map_original.png?v={{ map_version }}">
   <canvas id="route-canvas"></canvas>
   <div id="gps-dot" style="display:none;"></div>
   <div id="gps-error-circle" style="display:none;"></div>
@@ -164,7 +157,9 @@ const canvas = document.getElementById('route-canvas');
 const ctx = canvas.getContext('2d');
 const centerBtn = document.getElementById('center-btn');
 const startBtn = document.getElementById('start-btn');
-const pathData = {{ path_json|safe if path_json else 'null' }};
+// Route as flat [x0, y0, x1, y1, ...] map pixels; vertex i is at 2*i, 2*i+1
+const pathXY = {% if path_json %}new Float32Array({{ path_json|safe }}){% else %}null{% endif %};
+const pathLen = pathXY ? pathXY.length / 2 : 0;
 const showStart = {{ 'true' if show_start else 'false' }};
 let walkedIndex = 0;
 let started = false;
@@ -194,10 +189,7 @@ if (centerBtn) {
 
 function setZoom(level) {
   zoomLevel = Math.max(0.2, Math.min(4.0, level));
-  map.style.transform = `scale(${zoomLevel})`;
-  canvas.style.transform = `scale(${zoomLevel})`;
-  drawPath();
-  updateOverlayPosition(); // ensure GPS stays accurate
+  updateMapPosition();
 }
 
 document.addEventListener("keydown", (e) => {
@@ -236,24 +228,35 @@ document.addEventListener('mousemove', (e) => {
   if (!isDragging) return;
   offsetX = e.clientX - originX;
   offsetY = e.clientY - originY;
-  updateMapPosition();
+  scheduleMapUpdate();
 });
 
 document.addEventListener('touchmove', (e) => {
   if (!isDragging || e.touches.length !== 1) return;
   offsetX = e.touches[0].clientX - originX;
   offsetY = e.touches[0].clientY - originY;
-  updateMapPosition();
+  scheduleMapUpdate();
   e.preventDefault();
 }, { passive: false });
 
+// Pointer events can fire several times per frame; apply the latest offsets
+// at most once per frame.
+let mapUpdatePending = false;
+function scheduleMapUpdate() {
+  if (mapUpdatePending) return;
+  mapUpdatePending = true;
+  requestAnimationFrame(() => {
+    mapUpdatePending = false;
+    updateMapPosition();
+  });
+}
+
+// One composited transform for pan + zoom: no layout or paint per move
 function updateMapPosition() {
-  map.style.left = offsetX + 'px';
-  map.style.top  = offsetY + 'px';
-  canvas.style.left = offsetX + 'px';
-  canvas.style.top  = offsetY + 'px';
+  const t = `translate3d(${offsetX}px, ${offsetY}px, 0) scale(${zoomLevel})`;
+  map.style.transform = t;
+  canvas.style.transform = t;
   updateOverlayPosition();
-  drawPath();
 }
 
 // Reposition dot + error circle on every map move
@@ -275,40 +278,83 @@ function updateOverlayPosition() {
 function resizeCanvas() {
   canvas.width = map.naturalWidth;
   canvas.height = map.naturalHeight;
-  drawPath();
+  drawPath(true);  // resizing cleared the canvas
 }
 
-function drawPath() {
+// The canvas is in map pixels and moves/zooms with the map via CSS, so it
+// only needs repainting when progress along the route changes.
+let drawnIndex = null;
+function drawPath(force) {
+  if (!force && walkedIndex === drawnIndex) return;
+  drawnIndex = walkedIndex;
   ctx.clearRect(0, 0, canvas.width, canvas.height);
-  if (!pathData) return;
+  if (!pathXY) return;
+  // One path per colour, stroked once each, instead of a stroke per segment
+  const walked = new Path2D();
+  const ahead = new Path2D();
+  for (let i = 0; i < pathLen - 1; i++) {
+    const p = i < walkedIndex ? walked : ahead;
+    p.moveTo(pathXY[2 * i], pathXY[2 * i + 1]);
+    p.lineTo(pathXY[2 * i + 2], pathXY[2 * i + 3]);
+  }
   ctx.setLineDash([10, 10]);
   ctx.lineWidth = 4;
-  for (let i = 0; i < pathData.length - 1; i++) {
-    ctx.strokeStyle = i < walkedIndex ? '#888' : 'blue';
-    ctx.beginPath();
-    ctx.moveTo(pathData[i][0], pathData[i][1]);
-    ctx.lineTo(pathData[i + 1][0], pathData[i + 1][1]);
-    ctx.stroke();
-  }
+  ctx.strokeStyle = '#888';
+  ctx.stroke(walked);
+  ctx.strokeStyle = 'blue';
+  ctx.stroke(ahead);
 }
 
-function updateProgress(x, y) {
-  if (!started || !pathData) return;
-  let best = Infinity;
-  let idx = walkedIndex;
-  for (let i = walkedIndex; i < pathData.length; i++) {
-    const dx = pathData[i][0] - x;
-    const dy = pathData[i][1] - y;
-    const d = Math.hypot(dx, dy);
-    if (d < best) {
-      best = d;
+// Nearest route segment to (x, y) among segments [from, to), where segment i
+// runs from vertex i to vertex i+1. The route is simplified, so segments can
+// be long and the walker is usually far from every vertex while still on
+// the line: measure to the segment, not its endpoints. Returns the segment,
+// the squared distance and how far along it (0..1) the closest point lies.
+function nearestSegment(x, y, from, to) {
+  let best2 = Infinity;
+  let idx = from;
+  let bestT = 0;
+  for (let i = from; i < to; i++) {
+    const ax = pathXY[2 * i], ay = pathXY[2 * i + 1];
+    const sx = pathXY[2 * i + 2] - ax, sy = pathXY[2 * i + 3] - ay;
+    const len2 = sx * sx + sy * sy;
+    let t = len2 > 0 ? ((x - ax) * sx + (y - ay) * sy) / len2 : 0;
+    t = Math.max(0, Math.min(1, t));
+    const dx = ax + t * sx - x;
+    const dy = ay + t * sy - y;
+    const d2 = dx * dx + dy * dy;
+    if (d2 < best2) {
+      best2 = d2;
       idx = i;
+      bestT = t;
     }
   }
-  if (best < 20) walkedIndex = idx;
-  if (walkedIndex >= pathData.length - 1 && best < 20) {
+  return [idx, best2, bestT];
+}
+
+const PROGRESS_LOOKAHEAD = 5;
+const PROGRESS_RADIUS2 = 20 * 20;
+
+function updateProgress(x, y) {
+  if (!started || !pathXY) return;
+  const last = pathLen - 1;
+  // Walkers move forward along the route, so look at the next few segments
+  // first and only scan the rest of the route if none of them is close.
+  let [idx, best2, t] = nearestSegment(x, y, walkedIndex,
+                                       Math.min(last, walkedIndex + PROGRESS_LOOKAHEAD));
+  if (best2 >= PROGRESS_RADIUS2) {
+    [idx, best2, t] = nearestSegment(x, y, walkedIndex, last);
+  }
+  // On segment idx everything before it is walked; at its far end, it is too
+  if (best2 < PROGRESS_RADIUS2) walkedIndex = t >= 1 ? idx + 1 : idx;
+  const ex = pathXY[2 * last] - x;
+  const ey = pathXY[2 * last + 1] - y;
+  if (ex * ex + ey * ey < PROGRESS_RADIUS2) {
+    walkedIndex = last;
+    drawPath();
     alert('You have arrived!');
     started = false;
+    return;
   }
   drawPath();
 }
@@ -318,17 +364,38 @@ if (map.complete) resizeCanvas();
 
 // GPS tracking
 if (navigator.geolocation) {
+  // At most one fire-and-forget POST per second
+  let lastSent = 0;
   navigator.geolocation.watchPosition(function(pos) {
-    fetch('/update_location', {
-      method: 'POST',
-      headers: {'Content-Type': 'application/json'},
-      body: JSON.stringify({lat: pos.coords.latitude, lon: pos.coords.longitude})
-    });
-  });
-
-  setInterval(async () => {
-    const r = await fetch('/get_location');
-    const j = await r.json();
+    const now = Date.now();
+    if (now - lastSent < 1000) return;
+    lastSent = now;
+    const body = JSON.stringify({lat: pos.coords.latitude, lon: pos.coords.longitude});
+    // A string beacon goes out as text/plain, which needs no CORS preflight;
+    // an application/json Blob makes Chromium throw. The server ignores the
+    // content type, and anything that fails here falls back to fetch.
+    let sent = false;
+    try {
+      sent = !!navigator.sendBeacon && navigator.sendBeacon('/update_location', body);
+    } catch (e) {}
+    if (!sent) {
+      fetch('/update_location', {method: 'POST', headers: {'Content-Type': 'application/json'}, body});
+    }
+  }, null, {maximumAge: 2000});
+
+  // The server pushes our position whenever it changes. If it refuses the
+  // stream (503: too many open maps) the EventSource closes for good, and we
+  // poll instead.
+  const locations = new EventSource('/location_stream');
+  locations.onmessage = (ev) => showPosition(JSON.parse(ev.data));
+  locations.onerror = () => {
+    if (locations.readyState !== EventSource.CLOSED) return;  // auto-reconnecting
+    setInterval(() => {
+      fetch('/get_location').then(r => r.json()).then(showPosition).catch(() => {});
+    }, 2000);
+  };
+
+  function showPosition(j) {
     if (j.x != null && j.y != null) {
       const dot = document.getElementById('gps-dot');
       const ring = document.getElementById('gps-error-circle');
@@ -345,7 +412,7 @@ if (navigator.geolocation) {
       updateOverlayPosition();
       updateProgress(j.x, j.y);
     }
-  }, 1000);
+  }
 }
 </script>
 
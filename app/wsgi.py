@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+wsgi.py
+
+WSGI entry point for running CampusPath under a production server, e.g.:
+
+    gunicorn -k gthread -w 1 --threads 32 -b 0.0.0.0:5000 wsgi:app
+
+Threads let several requests wait on Ollama at once (at most
+OLLAMA_NUM_PARALLEL of them generate; the rest wait their turn). Keep a
+single worker: each client's latest GPS fix is held in process memory.
+Every open map page also holds one thread for its /location_stream; at
+most LOCATION_STREAMS_MAX (default 16) streams are served, later pages
+poll instead, so keep --threads above that to leave room for page loads.
+"""
+
+from app import app  # noqa: F401
@@ -12,13 +12,15 @@ from flask import Flask, render_template_string, request, jsonify, send_from_dir
 import cv2, numpy as np, networkx as nx
 from skimage.morphology import skeletonize, remove_small_objects, remove_small_holes
 from scipy.spatial import cKDTree
-from PIL import Image
+from scipy.ndimage import convolve, label
 
 # ——— CONFIG ———
 ORIG_PNG       = "trinity_map_original.png"
 MASK_PNG       = "interactive_mask.png"
 OVERLAY_PNG    = "skeleton_overlay.png"
 GRAPH_PKL      = "trinity_path_graph.gpickle"
+GRAPH_CSR      = "trinity_path_graph_csr.npz"   # same graph as int32 coords + CSR arrays; all the router loads
+GRAPH_TREE     = "trinity_path_graph_tree.pkl"  # prebuilt cKDTree over those coords
 
 # post‐processing
 MIN_PIXELS     = 150
@@ -128,50 +130,62 @@ submitBtn.onclick = ()=>{
 def submit():
     try:
         f = request.files['mask']
-        img = Image.open(f.stream).convert('L')
-        mask_arr = np.array(img)
+        # decoded by libpng straight into a grayscale array (alpha dropped, as convert('L') did)
+        mask_arr = cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_GRAYSCALE)
         mask_bin = (mask_arr > 0).astype(np.uint8)
+        cv2.imwrite(MASK_PNG, mask_bin*255)
 
-        # clean + skeletonize
-        b = remove_small_holes(mask_bin.astype(bool), area_threshold=FILL_HOLES)
-        b = remove_small_objects(b, min_size=MIN_PIXELS)
-        sk = skeletonize(b).astype(np.uint8)
+        # clean + skeletonize, reusing the mask buffer (0/1 uint8 viewed as bool)
+        b = mask_bin.view(bool)
+        remove_small_holes(b, area_threshold=FILL_HOLES, out=b)
+        remove_small_objects(b, min_size=MIN_PIXELS, out=b)
+        sk = skeletonize(b).view(np.uint8)
 
         # autobridge endpoints
-        ys,xs = np.nonzero(sk)
-        ends=[]
         offsets=[(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)]
         h,w = sk.shape
-        for x,y in zip(xs,ys):
-            nb = sum(1 for dx,dy in offsets
-                     if 0<=x+dx<w and 0<=y+dy<h and sk[y+dy,x+dx])
-            if nb==1:
-                ends.append((x,y))
-        if ends:
-            tree=cKDTree(ends)
-            for i,j in tree.query_pairs(CONNECT_RADIUS):
-                x1,y1=ends[i]; x2,y2=ends[j]
-                cv2.line(sk,(x1,y1),(x2,y2),1,1)
-
-        # build graph
+        # 8-neighbour count of every pixel in one pass (zero outside the image)
+        nb = convolve(sk, np.ones((3,3), np.uint8), mode='constant') - sk
+        ys_e,xs_e = np.nonzero((sk==1) & (nb==1))
+        ends = np.column_stack((xs_e, ys_e)).astype(np.int32)
+        if len(ends):
+            pairs = cKDTree(ends).query_pairs(CONNECT_RADIUS, output_type='ndarray')
+            if len(pairs):
+                # every bridge as a 2-point open polyline, drawn in one call
+                cv2.polylines(sk, list(ends[pairs]), False, 1, 1)
+
+        # keep only the largest 8-connected piece; fragments can never be on a route
+        lab, n = label(sk, structure=np.ones((3,3), np.uint8))
+        if n > 1:
+            sizes = np.bincount(lab.ravel())
+            sizes[0] = 0
+            sk = (lab == sizes.argmax()).view(np.uint8)
+
+        # build graph over the bridged skeleton: one node per pixel, edges
+        # to its skeleton neighbours. This is the only full-image scan.
+        ys,xs = np.nonzero(sk)
         G=nx.Graph()
-        for x,y in zip(xs,ys):
-            if sk[y,x]:
-                G.add_node((x,y), x=int(x), y=int(y))
-        for x,y in zip(xs,ys):
-            for dx,dy in offsets:
-                nx_,ny_ = x+dx, y+dy
-                if 0<=nx_<w and 0<=ny_<h and sk[ny_,nx_]:
-                    G.add_edge((x,y),(nx_,ny_), weight=float(np.hypot(dx,dy)))
-
-        # save mask, overlay, graph
-        cv2.imwrite(MASK_PNG, (mask_bin*255).astype(np.uint8))
-        orig = cv2.imread(ORIG_PNG)
-        over = orig.copy()
-        ys2,xs2 = np.nonzero(sk)
-        over[ys2,xs2] = (0,0,255)
+        G.add_nodes_from(((x,y), {'x':x, 'y':y}) for x,y in zip(xs.tolist(), ys.tolist()))
+        for dx,dy in offsets:
+            wt = float(np.hypot(dx,dy))
+            # sk[y,x] & sk[y+dy,x+dx] over every (x,y) whose neighbour is in bounds
+            y0,x0 = max(0,-dy), max(0,-dx)
+            a = sk[y0:h-max(0,dy), x0:w-max(0,dx)]
+            nbr = sk[max(0,dy):h-max(0,-dy), max(0,dx):w-max(0,-dx)]
+            ey,ex = np.nonzero(a & nbr)
+            G.add_weighted_edges_from(((x,y),(x+dx,y+dy),wt)
+                                      for x,y in zip((ex+x0).tolist(), (ey+y0).tolist()))
+
+        # save overlay, graph
+        over = cv2.imread(ORIG_PNG)
+        over[ys,xs] = (0,0,255)
         cv2.imwrite(OVERLAY_PNG, over)
-        with open(GRAPH_PKL,'wb') as f: pickle.dump(G,f)
+        with open(GRAPH_PKL,'wb') as f: pickle.dump(G,f,protocol=5)
+        nodes = np.array(list(G.nodes()), dtype=np.int32).reshape(-1,2)
+        csr = nx.to_scipy_sparse_array(G, nodelist=[tuple(n) for n in nodes.tolist()],
+                                       weight='weight', format='csr')
+        np.savez(GRAPH_CSR, nodes=nodes, data=csr.data, indices=csr.indices, indptr=csr.indptr)
+        with open(GRAPH_TREE,'wb') as f: pickle.dump(cKDTree(nodes),f,protocol=5)
 
         return jsonify(success=True)
     except Exception as e:
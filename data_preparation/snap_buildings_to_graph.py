@@ -1,6 +1,7 @@
 import json
+import math
 import pickle
-from scipy.spatial import KDTree
+import numpy as np
 
 # Load the graph
 with open("trinity_path_graph.gpickle", "rb") as f:
@@ -10,23 +11,41 @@ with open("trinity_path_graph.gpickle", "rb") as f:
 with open("building_coordinates_all.json") as f:
     building_coords = json.load(f)
 
-# Prepare KD-Tree from node positions
+# Rasterize node positions: the nodes are skeleton pixels, so the nearest
+# node to a building is the nearest set pixel in a small window around it.
 positions = []
-nodes = []
 for node, data in G.nodes(data=True):
     # Ensure pos is a tuple of Python ints
     x, y = data.get('pos', node)
-    xi, yi = int(x), int(y)
-    positions.append((xi, yi))
-    nodes.append((xi, yi))
+    positions.append((int(x), int(y)))
+positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+w, h = positions.max(axis=0) + 1
+grid = np.zeros((h, w), dtype=bool)
+grid[positions[:, 1], positions[:, 0]] = True
 
-tree = KDTree(positions)
+def nearest_node(bx, by, r=16):
+    """Nearest set pixel of grid to (bx, by), growing the search window on a miss."""
+    while True:
+        x0, y0 = max(0, int(bx) - r), max(0, int(by) - r)
+        x1, y1 = min(w, int(bx) + r + 1), min(h, int(by) + r + 1)
+        pts = np.argwhere(grid[y0:y1, x0:x1])[:, ::-1] + (x0, y0)   # (x, y)
+        covers_all = x0 == 0 and y0 == 0 and x1 == w and y1 == h
+        if len(pts):
+            d2 = ((pts - (bx, by)) ** 2).sum(axis=1)
+            i = int(np.argmin(d2))
+            # A closer pixel can only lie outside the window if it is beyond r
+            if d2[i] <= r * r or covers_all:
+                return pts[i]
+            r = math.ceil(math.sqrt(d2[i]))
+        elif covers_all:
+            raise ValueError("graph has no nodes")
+        else:
+            r *= 2
 
 # Snap each building to nearest graph node
 building_to_node = {}
-for name, coord in building_coords.items():
-    dist, idx = tree.query(coord)
-    building_to_node[name] = list(nodes[idx])  # list of ints, JSON-friendly
+for name, (bx, by) in building_coords.items():
+    building_to_node[name] = nearest_node(bx, by).tolist()  # list of ints, JSON-friendly
 
 # Save mapping
 with open("building_to_node_mapping.json", "w") as f: